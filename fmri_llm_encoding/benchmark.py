@@ -0,0 +1,321 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import platform
+import contextlib
+import subprocess
+import importlib.util
+from types import SimpleNamespace
+import numpy as np
+from emb_store import write_store
+import textgrid_io
+from profiling import PeakRSS
+
+# === 合成数据基准测试 ===
+# 按给定规模 (每个 run 的句子数 / 体素数 / 层数 / 特征维度) 生成合成 TextGrid, NIfTI run 与 embedding 存储,
+# 对流水线各阶段计时 (repeat 次取中位数), 记录吞吐量与阶段内 RSS 峰值, 写成带 git commit 的 JSON 基线.
+# --compare 与旧基线逐阶段比较, 超出容差即为性能回退 (退出码 1).
+# 缺少可选依赖 (torch / transformers / nibabel) 的阶段记为 skipped. 合成数据按规模缓存在 workdir, 重复运行不再生成
+SCALES = {
+    "small":  dict(sentences=120, voxels=20_000, layers=9, dim=128, runs=1),
+    "medium": dict(sentences=200, voxels=100_000, layers=17, dim=512, runs=2),
+    "full":   dict(sentences=250, voxels=480_000, layers=33, dim=4096, runs=1),
+}
+STAGES = ["textgrid", "pooling", "extract", "preprocess", "sentence_bold", "voxel_selection", "cv"]
+# 合成 TextGrid: 每句单词数 / 单词时长 / 句间静音 (秒)
+WORDS_PER_SENT = 8
+WORD_DUR = 0.35
+GAP = 0.4
+# 合成 BOLD: 受句子特征驱动的体素比例与延迟
+SIGNAL_FRAC = 0.05
+SIGNAL_DELAY = 6.0
+# 回退判定: 时间 / 内存增幅超过该比例 (内存另有固定余量, 避免小数值抖动误报)
+TIME_TOL = 0.25
+MEM_TOL = 0.25
+MEM_SLACK_MB = 32.0
+# 基线 JSON 默认放在源码树之外, 与默认的合成数据目录同级 (源码树里的结果文件不会被 git_info 的 dirty 标记发现)
+BENCH_ROOT = os.path.join(tempfile.gettempdir(), "fmri_llm_bench")
+BENCH_DIR = os.path.join(BENCH_ROOT, "baselines")
+
+def _missing(*mods):
+    return [m for m in mods if importlib.util.find_spec(m) is None]
+
+def git_info():
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=cwd, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=cwd,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = None, None
+    return {"commit": commit, "dirty": dirty}
+
+# === 合成数据 ===
+def synth_sentences(n, rng, vocab_size=500):
+    letters = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+    vocab = ["".join(rng.choice(letters, size=rng.integers(2, 9))) for _ in range(vocab_size)]
+    return [[vocab[i] for i in rng.integers(0, vocab_size, size=WORDS_PER_SENT)] for _ in range(n)]
+
+def write_textgrid(path, sents):
+    # Praat 长格式, 一个 IntervalTier: 单词, 每句后接一个 "#" 边界
+    items, t = [], 0.0
+    for words in sents:
+        for w in words:
+            items.append((t, t + WORD_DUR, w)); t += WORD_DUR
+        items.append((t, t + GAP, "#")); t += GAP
+    lines = ['File type = "ooTextFile"', 'Object class = "TextGrid"', "", "xmin = 0", f"xmax = {t}",
+             "tiers? <exists>", "size = 1", "item []:", "    item [1]:", '        class = "IntervalTier"',
+             '        name = "words"', "        xmin = 0", f"        xmax = {t}", f"        intervals: size = {len(items)}"]
+    for k, (a, b, lbl) in enumerate(items, 1):
+        lines += [f"        intervals [{k}]:", f"            xmin = {a}", f"            xmax = {b}", f'            text = "{lbl}"']
+    with open(path, "w", encoding="utf-8") as fh:
+        fh.write("\n".join(lines) + "\n")
+    return t
+
+def synth_embeddings(n, layers, dim, rng):
+    # 各层共享一个句子成分 (越深权重越大) + 独立噪声; 返回 (X [n, layers, dim], 句子成分)
+    base = rng.standard_normal((n, dim), dtype=np.float32)
+    w = np.linspace(0.2, 1.0, layers, dtype=np.float32)[None, :, None]
+    return base[:, None, :] * w + rng.standard_normal((n, layers, dim), dtype=np.float32), base
+
+def synth_bold(intervals, base, n_tr, n_vox, rng):
+    # [n_vox, n_tr]: 噪声 + 基线; 前 SIGNAL_FRAC 的体素叠加 SIGNAL_DELAY 后的句子成分
+    from fmri_prep import TR, averaging_operator
+    A, _ = averaging_operator(intervals, [SIGNAL_DELAY], n_tr, TR)
+    latent = np.asarray(A.T @ base[:len(intervals), :8])
+    k = max(1, int(SIGNAL_FRAC * n_vox))
+    data = rng.standard_normal((n_vox, n_tr), dtype=np.float32)
+    data[:k] += (latent @ rng.standard_normal((latent.shape[1], k)).astype(np.float32)).T * 0.5
+    return data + 1000.0
+
+def generate(ws, scale, seed):
+    # 返回每个 run 的 (run, 句子单词列表); 已按相同规模/种子生成过则直接复用
+    meta_path = os.path.join(ws, "scale.json")
+    want = dict(scale, seed=seed, nifti=not _missing("nibabel"))
+    runs = list(range(15, 15 + scale["runs"]))
+    rng = np.random.default_rng(seed)
+    sents = {r: synth_sentences(scale["sentences"], rng) for r in runs}
+    if os.path.exists(meta_path):
+        with open(meta_path, encoding="utf-8") as fh:
+            if json.load(fh) == want: return sents
+        shutil.rmtree(ws)
+    for sub in ("textgrid", "fmri", "emb"):
+        os.makedirs(os.path.join(ws, sub), exist_ok=True)
+    side = int(np.ceil(scale["voxels"] ** (1 / 3)))
+    for run in runs:
+        fname = f"lppEN_section{run - 14}.TextGrid"
+        tg = os.path.join(ws, "textgrid", fname)
+        dur = write_textgrid(tg, sents[run])
+        X, base = synth_embeddings(len(sents[run]), scale["layers"], scale["dim"], rng)
+        write_store(os.path.join(ws, "emb"), fname, list(X), range(len(X)), [" ".join(s) for s in sents[run]],
+                    layers=range(scale["layers"]), n_layers=scale["layers"] - 1)
+        if not _missing("nibabel"):
+            import nibabel as nib
+            from fmri_prep import TR
+            n_tr = int(np.ceil(dur / TR)) + 10
+            data = synth_bold(textgrid_io.sentence_intervals(tg), base, n_tr, side ** 3, rng)
+            img = nib.Nifti1Image(data.reshape(side, side, side, n_tr), np.eye(4))
+            nib.save(img, os.path.join(ws, "fmri", f"sub-bench_task-lpp_run-{run}_bold.nii.gz"))
+            del data, img
+    with open(meta_path, "w", encoding="utf-8") as fh:
+        json.dump(want, fh)
+    return sents
+
+# === 计时 ===
+def measure(fn, repeat, setup=None):
+    times, peaks, deltas = [], [], []
+    for _ in range(repeat):
+        if setup is not None: setup()
+        with PeakRSS() as mem, contextlib.redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter()
+            fn()
+            dt = time.perf_counter() - t0
+        times.append(dt); peaks.append(mem.peak); deltas.append(mem.peak - mem.start)
+    med = float(np.median(times))
+    return {"seconds": med, "seconds_min": float(min(times)),
+            "peak_rss_mb": max(peaks) / 2 ** 20, "rss_delta_mb": max(deltas) / 2 ** 20}
+
+def synth_tokens(words):
+    # 模拟 byte-level BPE: 词首带 Ġ, 长词拆成两段
+    toks = []
+    for k, w in enumerate(words):
+        head = ("Ġ" if k else "") + w
+        toks += [head[:4], head[4:]] if len(head) > 4 else [head]
+    return toks
+
+def bench_textgrid(ws, sents, scale, args):
+    files = sorted(os.path.join(ws, "textgrid", f) for f in os.listdir(os.path.join(ws, "textgrid")))
+    def parse():
+        textgrid_io._cache.clear()
+        for f in files: textgrid_io.load_sentences(f)
+    n = sum(len(s) for s in sents.values())
+    yield "textgrid", parse, None, n, "sentences"
+
+def bench_pooling(ws, sents, scale, args):
+    import torch
+    from step1_extract import Extractor, token_groups_robust, pooling_weights, make_batches, BATCH_SIZE
+    words = [w for s in sents.values() for w in s]
+    toks = [synth_tokens(w) for w in words]
+    lengths = [len(t) + 1 for t in toks]
+    torch.manual_seed(args.seed)
+    hidden = torch.randn(scale["layers"], BATCH_SIZE, max(lengths), scale["dim"])
+    ext = SimpleNamespace(layer_ids=list(range(scale["layers"])))
+    def pool():
+        for batch in make_batches(lengths, BATCH_SIZE, max_tokens=BATCH_SIZE * max(lengths)):
+            T = max(lengths[i] for i in batch)
+            w = np.zeros((len(batch), T), dtype=np.float32)
+            for b, i in enumerate(batch):
+                w[b, :lengths[i]] = pooling_weights(token_groups_robust(words[i], toks[i]), lengths[i], 1)
+            Extractor._pool(ext, hidden[:, :len(batch), :T], w)
+    yield "pooling", pool, None, len(words), "sentences"
+
+def bench_extract(ws, sents, scale, args):
+    # 随机初始化的小 Llama (见 tiny_llama.py): 衡量分词 / 对齐 / 分批 / pooling 的流水线开销, 不代表 8B 模型的算力
+    import tiny_llama
+    from step1_extract import Extractor
+    texts = [" ".join(w) for s in sents.values() for w in s]
+    path = os.path.join(ws, f"tiny_llama-{args.extract_layers}x{args.extract_hidden}")
+    if not os.path.exists(os.path.join(path, "config.json")):
+        tiny_llama.build_tiny_model(path, n_layers=args.extract_layers, hidden=args.extract_hidden, sents=texts)
+    with contextlib.redirect_stdout(io.StringIO()):
+        ext = Extractor(path, device="cpu", threads=args.threads)
+    yield "extract", lambda: ext.process_batch(texts), None, len(texts), "sentences"
+
+def bench_encoding(ws, sents, scale, args):
+    import step2_encoding as s2
+    s2.TEXTGRID_DIR = os.path.join(ws, "textgrid")
+    s2.FMRI_CACHE_DIR = os.path.join(ws, "fmri_cache")
+    s2.RESULTS_DIR = os.path.join(ws, "results")
+    s2.MEM_CAP_GB = args.mem_cap_gb
+    fmri_dir, emb_dir, runs = os.path.join(ws, "fmri"), os.path.join(ws, "emb"), sorted(sents)
+    n_sent = sum(len(s) for s in sents.values())
+
+    shapes = [s2.load_run(r, fmri_dir)[0].shape for r in runs]
+    yield ("preprocess", lambda: [s2.load_run(r, fmri_dir) for r in runs],
+           lambda: shutil.rmtree(s2.FMRI_CACHE_DIR, ignore_errors=True), sum(a * b for a, b in shapes), "voxel-TRs")
+
+    preps = [s2.prepare_run(r, fmri_dir) for r in runs]
+    yield ("sentence_bold", lambda: [s2.load_fmri_with_delay(p["run"], p["intervals"], d, p["M"])
+                                     for p in preps for d in s2.CANDIDATE_DELAYS],
+           None, n_sent * len(s2.CANDIDATE_DELAYS), "sentence-delays")
+
+    feats = [s2.load_features(emb_dir, p["fname"]) for p in preps]
+    ids = [[i for i in f[1]["sent_ids"] if i < len(p["intervals"])] for p, f in zip(preps, feats)]
+    select = lambda: [s2.select_target(p, f, i, "bench") for p, f, i in zip(preps, feats, ids)]
+    yield "voxel_selection", select, None, n_sent, "sentences"
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        targets = select()
+    cv = lambda: [s2.evaluate_features("bench", emb_dir, f, p, t, args.workers)
+                  for p, f, t in zip(preps, feats, targets) if t is not None]
+    yield "cv", cv, None, len(runs) * scale["layers"] * 5, "layer-folds"
+
+# 阶段组: (生成阶段的函数, 需要的模块)
+GROUPS = [
+    (bench_textgrid, []),
+    (bench_pooling, ["torch", "transformers"]),
+    (bench_extract, ["torch", "transformers", "tokenizers"]),
+    (bench_encoding, ["nibabel"]),
+]
+GROUP_STAGES = {bench_textgrid: ["textgrid"], bench_pooling: ["pooling"], bench_extract: ["extract"],
+                bench_encoding: ["preprocess", "sentence_bold", "voxel_selection", "cv"]}
+
+def run_benchmark(scale_name, scale, args):
+    ws = args.workdir or os.path.join(BENCH_ROOT, scale_name)
+    sents = generate(ws, scale, args.seed)
+    stages = {}
+    for group, deps in GROUPS:
+        names = [s for s in GROUP_STAGES[group] if s in args.stages]
+        if not names: continue
+        missing = _missing(*deps)
+        if missing:
+            for s in names:
+                stages[s] = {"skipped": f"missing {', '.join(missing)}"}
+                print(f"   {s:<16s} skipped ({stages[s]['skipped']})", flush=True)
+            continue
+        for name, fn, setup, items, unit in group(ws, sents, scale, args):
+            if name not in names: continue
+            res = measure(fn, args.repeat, setup)
+            res.update(items=items, unit=unit, throughput=items / res["seconds"] if res["seconds"] > 0 else None)
+            stages[name] = res
+            print(f"   {name:<16s} {res['seconds']:8.3f}s  {res['throughput']:12.1f} {unit}/s  "
+                  f"peak RSS {res['peak_rss_mb']:8.1f} MB (+{res['rss_delta_mb']:.1f})", flush=True)
+    return {
+        "git": git_info(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": {"node": platform.node(), "machine": platform.machine(), "python": platform.python_version(),
+                 "numpy": np.__version__, "cpu_count": os.cpu_count()},
+        "scale_name": scale_name,
+        "scale": scale,
+        "config": {"repeat": args.repeat, "workers": args.workers, "threads": args.threads, "seed": args.seed,
+                   "mem_cap_gb": args.mem_cap_gb, "extract_model": [args.extract_layers, args.extract_hidden]},
+        "stages": stages,
+    }
+
+def compare(cur, base, time_tol=TIME_TOL, mem_tol=MEM_TOL):
+    # 返回回退列表; 规模或配置不同的基线不可比较
+    if cur["scale"] != base["scale"] or cur["config"] != base["config"]:
+        raise ValueError(f"baseline scale/config differ: {base['scale']} {base['config']} vs {cur['scale']} {cur['config']}")
+    regressions = []
+    print(f"\n Compare with {(base['git'].get('commit') or '?')[:10]} ({base['created']}):")
+    for name, c in cur["stages"].items():
+        b = base["stages"].get(name)
+        if b is None or "skipped" in c or "skipped" in b: continue
+        t_ratio = c["seconds"] / b["seconds"] if b["seconds"] > 0 else 1.0
+        mem_limit = b["rss_delta_mb"] * (1 + mem_tol) + MEM_SLACK_MB
+        flags = []
+        if t_ratio > 1 + time_tol: flags.append("TIME")
+        if c["rss_delta_mb"] > mem_limit: flags.append("MEMORY")
+        print(f"   {name:<16s} time x{t_ratio:5.2f}  mem {b['rss_delta_mb']:8.1f} -> {c['rss_delta_mb']:8.1f} MB"
+              f"  {' '.join(flags) or 'ok'}")
+        regressions += [(name, f) for f in flags]
+    return regressions
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Synthetic-data benchmarks for the extraction and encoding pipeline")
+    ap.add_argument("--scale", choices=list(SCALES), default="small")
+    ap.add_argument("--sentences", type=int, help="sentences per run (overrides the preset)")
+    ap.add_argument("--voxels", type=int)
+    ap.add_argument("--layers", type=int)
+    ap.add_argument("--dim", type=int)
+    ap.add_argument("--runs", type=int)
+    ap.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--workers", type=int, default=1, help="layer x fold workers in the cv stage")
+    ap.add_argument("--threads", type=int, default=None, help="torch CPU threads for the extract stage")
+    ap.add_argument("--mem-cap-gb", type=float, default=None, help="step2 MEM_CAP_GB for the fMRI stages")
+    ap.add_argument("--extract-layers", type=int, default=4)
+    ap.add_argument("--extract-hidden", type=int, default=64)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--workdir", default=None, help="where synthetic data is generated and reused")
+    ap.add_argument("--out", default=None, help="baseline JSON to write (default baselines/<scale>-<commit>.json next to the workdir)")
+    ap.add_argument("--compare", default=None, help="baseline JSON to check for regressions")
+    ap.add_argument("--time-tol", type=float, default=TIME_TOL)
+    ap.add_argument("--mem-tol", type=float, default=MEM_TOL)
+    args = ap.parse_args()
+
+    scale = dict(SCALES[args.scale])
+    for k in scale:
+        if getattr(args, k) is not None: scale[k] = getattr(args, k)
+    name = args.scale if scale == SCALES[args.scale] else "custom"
+    print(f" Benchmark [{name}] {scale}", flush=True)
+    result = run_benchmark(name, scale, args)
+
+    bench_dir = os.path.join(os.path.dirname(os.path.abspath(args.workdir)), "baselines") if args.workdir else BENCH_DIR
+    out = args.out or os.path.join(bench_dir, f"{name}-{(result['git']['commit'] or 'nogit')[:10]}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as fh:
+        json.dump(result, fh, indent=1)
+    print(f" Saved {out}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh:
+            regressions = compare(result, json.load(fh), args.time_tol, args.mem_tol)
+        if regressions:
+            print(f" {len(regressions)} regressions: {regressions}")
+            sys.exit(1)
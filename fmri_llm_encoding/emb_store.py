@@ -0,0 +1,108 @@
+import os
+import re
+import glob
+import json
+import argparse
+import tempfile
+import numpy as np
+from textgrid_io import sentence_texts
+
+# === 句向量存储 ===
+# 每个模型目录下, 每个 section 一个连续存储 (替代逐句 .npy):
+#   {fname}.emb.npy   [n_sentences, n_layers, dim] float32, 用 np.memmap 按层切片读取
+#   {fname}.emb.json  句子 id / 文本 / 被跳过的句子
+STORE_SUFFIX = ".emb.npy"
+INDEX_SUFFIX = ".emb.json"
+SENT_FILE_RE = re.compile(r"^(?P<fname>.+)_sent(?P<idx>\d+)\.npy$")
+
+def store_paths(folder, fname):
+    base = os.path.join(folder, fname)
+    return base + STORE_SUFFIX, base + INDEX_SUFFIX
+
+def atomic_write(path, write_fn):
+    # 每次写入用唯一的临时文件 (同目录, os.replace 才是原子的): 并发写同一路径的进程互不覆盖临时文件
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        with open(tmp, "wb") as fh:
+            write_fn(fh)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp): os.remove(tmp)
+        raise
+
+def write_store(folder, fname, embs, sent_ids, texts, skipped=(), layers=None, n_layers=None, features=None):
+    # embs: 与 sent_ids 对齐的 [n_layers, dim] 列表; skipped: [(id, text), ...]
+    # layers: 第二维对应的层号 (0 = embedding); n_layers: 模型总 decoder 层数
+    # features: 最后一维各列的名称 (注意力摘要的 "统计量/h头"); None 表示 hidden state, 不记录
+    data_path, index_path = store_paths(folder, fname)
+    X = np.stack(embs).astype(np.float32) if embs else np.zeros((0, 0, 0), dtype=np.float32)
+    index = {
+        "shape": list(X.shape),
+        "sent_ids": [int(i) for i in sent_ids],
+        "texts": list(texts),
+        "skipped": [{"id": int(i), "text": t} for i, t in skipped],
+        "layers": [int(l) for l in layers] if layers is not None else list(range(X.shape[1])),
+        "n_layers": int(n_layers) if n_layers is not None else X.shape[1] - 1,
+    }
+    if features is not None:
+        if embs and len(features) != X.shape[2]:
+            raise ValueError(f"{len(features)} feature names for dim {X.shape[2]}")
+        index["features"] = list(features)
+    atomic_write(data_path, lambda fh: np.save(fh, X))
+    atomic_write(index_path, lambda fh: fh.write(json.dumps(index, ensure_ascii=False, indent=1).encode("utf-8")))
+    return data_path
+
+def list_stores(folder):
+    return sorted(os.path.basename(p)[:-len(STORE_SUFFIX)]
+                  for p in glob.glob(os.path.join(folder, "*" + STORE_SUFFIX)))
+
+def open_store(folder, fname):
+    # 返回 (X, index); X 为只读 np.memmap, X[:, l, :] 只读取该层
+    data_path, index_path = store_paths(folder, fname)
+    if not (os.path.exists(data_path) and os.path.exists(index_path)):
+        return None, None
+    with open(index_path, encoding="utf-8") as fh:
+        index = json.load(fh)
+    # 旧索引没有层信息: 默认包含全部层
+    index.setdefault("layers", list(range(index["shape"][1])))
+    index.setdefault("n_layers", index["shape"][1] - 1)
+    if not index["sent_ids"]:
+        return np.load(data_path), index
+    return np.load(data_path, mmap_mode="r"), index
+
+# === 迁移: 逐句 .npy -> 连续存储 ===
+def migrate_npy_dir(folder, textgrid_dir=None, delete=False):
+    groups = {}
+    for p in glob.glob(os.path.join(folder, "*_sent*.npy")):
+        m = SENT_FILE_RE.match(os.path.basename(p))
+        if m: groups.setdefault(m.group("fname"), []).append((int(m.group("idx")), p))
+
+    for fname, items in sorted(groups.items()):
+        items.sort()
+        ids = [i for i, _ in items]
+        id_set, sents = set(ids), None
+        if textgrid_dir:
+            tg = os.path.join(textgrid_dir, fname)
+            if os.path.exists(tg): sents = sentence_texts(tg)
+        if sents:
+            texts = [sents[i] if i < len(sents) else None for i in ids]
+            skipped = [(i, s) for i, s in enumerate(sents) if i not in id_set]
+        else:
+            # 没有 TextGrid 时文本未知, 只能从 id 的空缺推断跳过的句子
+            texts = [None] * len(ids)
+            skipped = [(i, None) for i in range(ids[-1] + 1) if i not in id_set]
+
+        write_store(folder, fname, [np.load(p) for _, p in items], ids, texts, skipped)
+        if delete:
+            for _, p in items: os.remove(p)
+        print(f"   {fname}: {len(ids)} sentences migrated ({len(skipped)} skipped)")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Migrate per-sentence .npy embeddings to section stores")
+    ap.add_argument("folder")
+    ap.add_argument("--textgrid-dir", default=None)
+    ap.add_argument("--delete", action="store_true", help="remove the per-sentence .npy files afterwards")
+    args = ap.parse_args()
+    migrate_npy_dir(args.folder, args.textgrid_dir, args.delete)
@@ -0,0 +1,119 @@
+import numpy as np
+from sklearn.decomposition import PCA
+from profiling import stage
+
+# 固定 PCA 随机种子: 特征维度大时 sklearn 自动用 randomized SVD, 否则结果不可复现
+PCA_SEED = 42
+# colwise_pearson 每次升到 float64 的列数, 整脑输入时限制临时内存
+PEARSON_BLOCK = 8192
+
+# === 编码模型的向量化计算核 ===
+def colwise_pearson(P, Y, eps=1e-9):
+    # 逐列 Pearson r (预测 vs 目标), 一次矩阵运算算完所有体素;
+    # 任一列近似常数 (std <= eps) 或结果非有限时为 NaN, 与原来逐列 pearsonr 的保护一致.
+    # 输入可以是 float32, 按 PEARSON_BLOCK 列分块在 float64 中计算
+    n_cols = P.shape[1] if np.ndim(P) > 1 else 1
+    if n_cols > PEARSON_BLOCK:
+        return np.concatenate([colwise_pearson(P[:, c:c + PEARSON_BLOCK], Y[:, c:c + PEARSON_BLOCK], eps)
+                               for c in range(0, n_cols, PEARSON_BLOCK)])
+    P = np.asarray(P, dtype=np.float64)
+    Y = np.asarray(Y, dtype=np.float64)
+    Pc = P - P.mean(axis=0)
+    Yc = Y - Y.mean(axis=0)
+    sp = np.sqrt((Pc * Pc).mean(axis=0))
+    sy = np.sqrt((Yc * Yc).mean(axis=0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r = (Pc * Yc).mean(axis=0) / (sp * sy)
+    r[~((sp > eps) & (sy > eps) & np.isfinite(r))] = np.nan
+    return np.clip(r, -1.0, 1.0)
+
+class SVDRidge:
+    # 多 alpha 岭回归: 训练设计矩阵只做一次 SVD, 所有候选 alpha 共用.
+    # 每个体素 (列) 用高效留一法 (LOO) 误差单独选 alpha; 只有一个 alpha 时等价于 Ridge(alpha)
+    def __init__(self, alphas=(1000.0,)):
+        self.alphas = np.asarray(alphas, dtype=np.float64).ravel()
+
+    def fit(self, X, Y):
+        X = np.asarray(X, dtype=np.float64)
+        Y = np.asarray(Y)
+        n = X.shape[0]
+        self.x_mean_ = X.mean(axis=0)
+        self.y_mean_ = Y.mean(axis=0, dtype=np.float64)
+        U, s, self.Vt_ = np.linalg.svd(X - self.x_mean_, full_matrices=False)
+        s2 = s * s
+        # X 已中心化, U 的列与常数向量正交, 所以 U^T Y == U^T (Y - mean)
+        UtY = U.T @ Y
+
+        if len(self.alphas) == 1:
+            best = np.zeros(Y.shape[1], dtype=int)
+        else:
+            Yc = Y - self.y_mean_
+            U2 = U * U
+            errs = np.empty((len(self.alphas), Y.shape[1]))
+            for i, a in enumerate(self.alphas):
+                f = s2 / (s2 + a)
+                # hat 矩阵对角 (含未惩罚的截距): 1/n + sum_k U_ik^2 * s_k^2 / (s_k^2 + a)
+                h = 1.0 / n + U2 @ f
+                R = (Yc - U @ (f[:, None] * UtY)) / (1.0 - h)[:, None]
+                errs[i] = (R * R).mean(axis=0)
+            best = errs.argmin(axis=0)
+
+        self.alpha_ = self.alphas[best]
+        # SVD 空间的系数 [k, n_targets], 每列对应自己的 alpha; 预测与 Y 同精度 (float32 Y 不会被放大成 float64)
+        dt = np.result_type(Y.dtype, np.float32)
+        self.coef_svd_ = ((s[:, None] / (s2[:, None] + self.alpha_[None, :])) * UtY).astype(dt, copy=False)
+        self.y_mean_ = self.y_mean_.astype(dt, copy=False)
+        return self
+
+    def predict(self, X):
+        # 所有体素的预测: 一次矩阵乘法
+        Z = (np.asarray(X, dtype=np.float64) - self.x_mean_) @ self.Vt_.T
+        return Z.astype(self.coef_svd_.dtype, copy=False) @ self.coef_svd_ + self.y_mean_
+
+def remove_confound(X, confounds):
+    if confounds.ndim == 1: confounds = confounds.reshape(-1, 1)
+    # 检查是否常数，避免报错
+    if np.std(confounds) < 1e-9: return X 
+    # 带截距的最小二乘 (同 LinearRegression), 只对小的设计矩阵求伪逆;
+    # 逐列独立, 可按体素块调用, X 保持自己的精度
+    D = np.hstack([np.ones((len(confounds), 1)), confounds])
+    dt = np.result_type(X.dtype, np.float32)
+    beta = np.linalg.pinv(D).astype(dt) @ X
+    return X - D.astype(dt) @ beta
+
+def prepare_folds(Y_roi, durations, splits):
+    # 目标端每个 fold 只去偏一次, 所有层 (以及共享目标时的所有模型) 共用
+    folds = []
+    for train_idx, test_idx in splits:
+        C_train, C_test = durations[train_idx], durations[test_idx]
+        # 关键：分别去偏
+        Y_train = remove_confound(Y_roi[train_idx], C_train)
+        Y_test = remove_confound(Y_roi[test_idx], C_test)
+        folds.append((train_idx, test_idx, C_train, C_test, Y_train, Y_test))
+    return folds
+
+def cv_fold_predict(X_layer, fold, pca_n, alphas):
+    # 单个 (层, fold) 的拟合, 返回 (测试集预测 [n_test, n_vox], 每个体素选中的 alpha); 串行/并行路径共用
+    train_idx, test_idx, C_train, C_test, Y_train, Y_test = fold
+    X_train, X_test = X_layer[train_idx], X_layer[test_idx]
+    
+    # PCA
+    with stage("pca"):
+        n_comp = min(pca_n, len(train_idx)-1)
+        pca = PCA(n_components=n_comp, random_state=PCA_SEED)
+        X_train = remove_confound(pca.fit_transform(X_train), C_train)
+        X_test = remove_confound(pca.transform(X_test), C_test)
+    
+    # 强正则化防止过拟合; alpha 逐体素选择
+    with stage("ridge"):
+        ridge = SVDRidge(alphas=alphas)
+        ridge.fit(X_train, Y_train)
+        return ridge.predict(X_test), ridge.alpha_
+
+def fold_score(preds, Y_test):
+    # 计算相关性
+    r = colwise_pearson(preds, Y_test)
+    corrs = r[~np.isnan(r)]
+    
+    # 记录该 Fold 的表现
+    return float(np.mean(corrs)) if corrs.size else 0.0
@@ -0,0 +1,83 @@
+import os
+import glob
+import json
+import hashlib
+import numpy as np
+from emb_store import atomic_write
+
+# === 提取缓存 (内容寻址) ===
+# key = sha1(模型身份, 句子文本, pooling 模式, 层集合), 每条一个 .npy, 原子写入;
+# manifest.json 记录已完成的 key. 中断或部分改动后的重跑只计算缺失/过期的条目
+MISS = object()
+
+def model_identity(path, config=None):
+    # 路径 + 配置 + 权重文件 (名称/大小/mtime), 任何一项变动都会使旧条目失效
+    h = hashlib.sha1(os.path.realpath(path).encode("utf-8"))
+    if config is not None:
+        h.update(config.to_json_string(use_diff=False).encode("utf-8"))
+    for f in sorted(glob.glob(os.path.join(path, "*.safetensors")) + glob.glob(os.path.join(path, "*.bin"))):
+        st = os.stat(f)
+        h.update(f"{os.path.basename(f)}:{st.st_size}:{st.st_mtime_ns}".encode("utf-8"))
+    return f"{os.path.basename(os.path.normpath(path))}-{h.hexdigest()[:16]}"
+
+def cache_key(identity, text, pooling="mean", layers=None):
+    layer_set = "all" if layers is None else [int(l) for l in layers]
+    payload = json.dumps([identity, text, pooling, layer_set], ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+class ExtractCache:
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.manifest_path = os.path.join(root, "manifest.json")
+        self.manifest = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding="utf-8") as fh:
+                self.manifest = json.load(fh)
+        self.hits, self.misses = 0, 0
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key + ".npy")
+
+    def get(self, key, count=True):
+        # 命中返回数组 (被跳过的句子返回 None), 否则返回 MISS
+        # count=False: 不计入命中统计, 由调用方按实际是否复用来计数 (见 record)
+        hit = self._get(key)
+        if count: self.record(hit is not MISS)
+        return hit
+
+    def record(self, hit, n=1):
+        if hit: self.hits += n
+        else: self.misses += n
+
+    def _get(self, key):
+        meta = self.manifest.get(key)
+        if meta is not None:
+            if meta.get("skipped"):
+                return None
+            try:
+                arr = np.load(self._path(key))
+                if list(arr.shape) == meta["shape"]:
+                    return arr
+            except (OSError, ValueError): pass # 条目缺失或损坏, 按 miss 重算
+        return MISS
+
+    def put(self, key, arr, **meta):
+        if arr is None:
+            meta["skipped"] = True
+        else:
+            p = self._path(key)
+            os.makedirs(os.path.dirname(p), exist_ok=True)
+            atomic_write(p, lambda fh: np.save(fh, arr))
+            meta["shape"] = list(arr.shape)
+        self.manifest[key] = meta
+
+    def flush(self):
+        # manifest 最后写: 进程中断时未登记的条目下次视为 miss
+        data = json.dumps(self.manifest, ensure_ascii=False).encode("utf-8")
+        atomic_write(self.manifest_path, lambda fh: fh.write(data))
+
+    def report(self):
+        total = self.hits + self.misses
+        rate = 100.0 * self.hits / total if total else 0.0
+        return f"cache: {self.hits} hits, {self.misses} misses ({rate:.1f}% hit)"
@@ -0,0 +1,183 @@
+import os
+import glob
+import json
+import hashlib
+import numpy as np
+import nibabel as nib
+from scipy.sparse import csr_matrix
+from emb_store import atomic_write
+
+# === fMRI 预处理缓存 ===
+# 每个 run 只读取并标准化一次 (float32), [n_tr, n_vox] 矩阵存为 .npy,
+# 之后以 memmap 打开; 各个候选 delay 的句子级 BOLD 都从这个矩阵计算.
+# 可选脑 mask: 在标准化之前去掉脑外体素, 同时保存体素在体积中的展平下标.
+# 给定内存上限 (mem_cap_gb) 时按时间块流式读取, 不再整体加载 4D 数据
+TR = 2.0
+PREP_VERSION = "zscore-f32-v1"
+# compute_epi_mask 的直方图截断 (同 nilearn 默认)
+EPI_LOWER_CUTOFF = 0.2
+EPI_UPPER_CUTOFF = 0.85
+# 流式预处理时每个 (体素, TR) 的峰值字节数: 磁盘数据缩放后的 float64 + float32 副本 + mask 后副本 + 标准化结果
+STREAM_BYTES_PER_VALUE = 24
+
+def find_run_file(fmri_dir, run_id):
+    fs = sorted(glob.glob(os.path.join(fmri_dir, f"*run?{run_id}*.nii.gz")))
+    return fs[0] if fs else None
+
+def _file_sig(path):
+    st = os.stat(path)
+    return [os.path.realpath(path), st.st_size, st.st_mtime_ns]
+
+class MaskError(Exception):
+    # mask 配置错误 (文件不存在 / 不可读 / 形状与 run 不符); 不是 OSError / ValueError,
+    # 调用方跳过单个坏 run 时不会把它一起吞掉
+    pass
+
+def _cache_key(nii_path, mask=None):
+    # 源文件 (路径/大小/mtime) + mask + 预处理版本; 任何一项变化都会重新计算
+    if mask == "epi": mask_sig = ["epi", EPI_LOWER_CUTOFF, EPI_UPPER_CUTOFF]
+    elif mask is not None:
+        if not os.path.isfile(mask): raise MaskError(f"mask {mask} does not exist")
+        mask_sig = _file_sig(mask)
+    else: mask_sig = None
+    sig = [_file_sig(nii_path), mask_sig, PREP_VERSION]
+    return hashlib.sha1(json.dumps(sig).encode("utf-8")).hexdigest()[:16]
+
+def standardize(flat):
+    # 与 StandardScaler 相同: 每个体素零均值/单位方差, 方差近 0 的体素 scale 取 1
+    mean = flat.mean(axis=0, dtype=np.float64)
+    std = flat.std(axis=0, dtype=np.float64)
+    std[std < 10 * np.finfo(np.float64).eps] = 1.0
+    return ((flat - mean.astype(np.float32)) / std.astype(np.float32)).astype(np.float32, copy=False)
+
+def compute_epi_mask(mean_epi, lower=EPI_LOWER_CUTOFF, upper=EPI_UPPER_CUTOFF):
+    # 平均 EPI 强度直方图在 [lower, upper] 分位区间内最大的间隙处作为阈值
+    vals = np.sort(mean_epi.ravel())
+    lo = int(np.floor(lower * len(vals)))
+    hi = min(int(np.floor(upper * len(vals))), len(vals) - 1)
+    gap = int(np.argmax(vals[lo + 1:hi + 1] - vals[lo:hi]))
+    thr = 0.5 * (vals[lo + gap] + vals[lo + gap + 1])
+    return mean_epi >= thr
+
+def load_mask(mask, mean_epi):
+    # mask: "epi" 由平均 EPI 计算, 否则为 mask NIfTI 路径 (非零即脑内)
+    if mask == "epi":
+        return compute_epi_mask(mean_epi)
+    try:
+        m = np.asanyarray(nib.load(mask).dataobj) != 0
+    except Exception as e:
+        raise MaskError(f"cannot read mask {mask}: {e}") from e
+    if m.shape != mean_epi.shape:
+        raise MaskError(f"mask {mask} has shape {m.shape}, run volume is {mean_epi.shape}")
+    return m
+
+def block_size(n_items, item_bytes, mem_cap_gb=None):
+    # 在内存上限内一次能处理多少项 (TR 或体素列); 没有上限时一次全部处理, 至少 1
+    if mem_cap_gb is None: return n_items
+    return int(max(1, min(n_items, mem_cap_gb * 1024 ** 3 // max(1, item_bytes))))
+
+def _time_blocks(img, step):
+    # 按时间块读取 [x, y, z, t0:t1] 并展平为 [体素, t]; 时间是 NIfTI 中最慢的轴, 所以是顺序读取
+    n_tr = img.shape[-1]
+    for t0 in range(0, n_tr, step):
+        t1 = min(n_tr, t0 + step)
+        yield t0, t1, np.asarray(img.dataobj[..., t0:t1], dtype=np.float32).reshape(-1, t1 - t0)
+
+def _standardize_streamed(nii_path, mask, mem_cap_gb, data_path):
+    # 两遍读取: 第一遍累加每个体素的和/平方和 (以第一帧为偏移, 减少抵消误差), 得到均值/方差与平均 EPI;
+    # 第二遍逐块标准化后按行写入 .npy memmap. 峰值内存 ~ 一个时间块 + 若干个体积大小的向量
+    img = nib.load(nii_path, keep_file_open=True)
+    vol_shape, n_tr = img.shape[:3], img.shape[-1]
+    step = block_size(n_tr, STREAM_BYTES_PER_VALUE * int(np.prod(vol_shape)), mem_cap_gb)
+    shift = s1 = s2 = None
+    for t0, t1, flat in _time_blocks(img, step):
+        if shift is None:
+            shift = flat[:, 0].astype(np.float64)
+            s1, s2 = np.zeros_like(shift), np.zeros_like(shift)
+        d = flat - shift[:, None].astype(np.float32)
+        s1 += d.sum(axis=1, dtype=np.float64)
+        s2 += np.einsum("ij,ij->i", d, d, dtype=np.float64)
+        del d
+    mean = shift + s1 / n_tr
+    std = np.sqrt(np.maximum(s2 / n_tr - (s1 / n_tr) ** 2, 0.0))
+    voxels = np.flatnonzero(load_mask(mask, mean.reshape(vol_shape))) if mask is not None else np.arange(len(mean))
+    std[std < 10 * np.finfo(np.float64).eps] = 1.0
+    mu, sd = mean[voxels].astype(np.float32)[:, None], std[voxels].astype(np.float32)[:, None]
+
+    def write(fh):
+        Z = np.lib.format.open_memmap(fh.name, mode="w+", dtype=np.float32, shape=(n_tr, len(voxels)))
+        for t0, t1, flat in _time_blocks(img, step):
+            Z[t0:t1] = ((flat[voxels] - mu) / sd).T
+        Z.flush()
+        del Z
+    atomic_write(data_path, write)
+    return voxels, vol_shape
+
+def load_run_matrix(nii_path, cache_dir, mask=None, mem_cap_gb=None):
+    # 返回 (Y, voxels, vol_shape): Y 为只读 memmap [n_tr, n_vox] (float32, 已标准化),
+    # voxels 为每列在体积中的展平下标 (C 序, 可用 np.unravel_index(voxels, vol_shape) 还原).
+    # mem_cap_gb 为 None 时整体加载; 否则流式处理, 结果与整体加载在 float32 精度内一致
+    name = os.path.basename(nii_path).split(".")[0]
+    base = os.path.join(cache_dir, f"{name}-{_cache_key(nii_path, mask)}")
+    data_path, vox_path, meta_path = base + ".npy", base + ".vox.npy", base + ".json"
+    if not os.path.exists(meta_path):
+        os.makedirs(cache_dir, exist_ok=True)
+        if mem_cap_gb is not None:
+            voxels, vol_shape = _standardize_streamed(nii_path, mask, mem_cap_gb, data_path)
+        else:
+            data = nib.load(nii_path).get_fdata(dtype=np.float32)
+            vol_shape, n_tr = data.shape[:3], data.shape[-1]
+            flat = data.reshape(-1, n_tr)
+            # 先 mask 再标准化: 脑外体素不参与任何后续计算
+            if mask is not None: voxels = np.flatnonzero(load_mask(mask, data.mean(axis=-1, dtype=np.float64)))
+            else: voxels = np.arange(flat.shape[0])
+            Z = standardize(flat[voxels].T if mask is not None else flat.T)
+            del data, flat
+            atomic_write(data_path, lambda fh: np.save(fh, Z))
+        atomic_write(vox_path, lambda fh: np.save(fh, voxels))
+        meta = json.dumps({"source": nii_path, "mask": mask, "vol_shape": list(vol_shape), "n_vox": int(len(voxels))})
+        atomic_write(meta_path, lambda fh: fh.write(meta.encode("utf-8")))
+    with open(meta_path, encoding="utf-8") as fh:
+        vol_shape = tuple(json.load(fh)["vol_shape"])
+    return np.load(data_path, mmap_mode="r"), np.load(vox_path), vol_shape
+
+def averaging_operator(intervals, delays, n_tr, tr=TR):
+    # 句子 -> TR 的平均算子: 所有 delay 纵向堆叠成一个稀疏矩阵 [sum_d n_d, n_tr],
+    # 第 k 个 delay 的行为 offsets[k]:offsets[k+1].
+    # 截断规则同原实现: tr_start >= n_tr 时该句及之后的句子丢弃; tr_end 截到 n_tr;
+    # 区间不足一个 TR 时取 tr_start 这一个 TR
+    rows, cols, vals, offsets = [], [], [], [0]
+    for delay in delays:
+        r = offsets[-1]
+        for t1, t2 in intervals:
+            tr_start = int((t1 + delay) / tr)
+            tr_end = int((t2 + delay) / tr) + 1
+            if tr_start >= n_tr: break
+            tr_end = min(tr_end, n_tr)
+            if tr_end <= tr_start: tr_end = tr_start + 1
+            k = tr_end - tr_start
+            rows.extend([r] * k); cols.extend(range(tr_start, tr_end)); vals.extend([1.0 / k] * k)
+            r += 1
+        offsets.append(r)
+    A = csr_matrix((np.asarray(vals, dtype=np.float32), (rows, cols)), shape=(offsets[-1], n_tr))
+    return A, offsets
+
+def voxel_blocks(n_vox, block):
+    # 体素列块 (切片), 按块计算的中间量只有 [行数, block] 大小
+    for v0 in range(0, n_vox, block):
+        yield slice(v0, min(n_vox, v0 + block))
+
+def bold_block(A, M, cols):
+    # 句子级 BOLD 的一个体素块: A (稀疏平均算子或其行切片) @ M[:, cols]; cols 可为切片或下标数组
+    return np.asarray(A @ np.asarray(M[:, cols], dtype=np.float32), dtype=np.float32)
+
+def sentence_bold_all(M, intervals, delays, tr=TR):
+    # 所有候选 delay 的句子级 BOLD: 一次稀疏矩阵乘法 A @ M; 返回 {delay: [n_sent, n_vox] 或 None}
+    A, offsets = averaging_operator(intervals, delays, M.shape[0], tr)
+    B = np.asarray(A @ np.asarray(M), dtype=np.float32)
+    return {d: (B[offsets[k]:offsets[k + 1]] if offsets[k + 1] > offsets[k] else None)
+            for k, d in enumerate(delays)}
+
+def sentence_bold(M, intervals, delay, tr=TR):
+    # 每句 [t1+delay, t2+delay] 覆盖的 TR 取平均; 超出扫描范围的句子截断
+    return sentence_bold_all(M, intervals, [delay], tr)[delay]
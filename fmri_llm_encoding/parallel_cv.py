@@ -0,0 +1,89 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from threadpoolctl import threadpool_limits
+from emb_store import open_store
+from encoding_utils import cv_fold_predict, fold_score, prepare_folds
+from profiling import stage, current_tags
+
+# === 并行 (层 x fold) 交叉验证 ===
+# Y_roi / durations 放进共享内存, 特征由 worker 自己以 memmap 打开, 都不经过 pickle;
+# 每个 worker 限制 BLAS 线程数, 避免 N_WORKERS x BLAS 线程过度订阅.
+# 划分在主进程算好, 结果按 (层, fold) 放回, 与串行路径逐位一致.
+# 特征行由 rows 指定 (与目标端的句子 id 对齐), 每层读取后再取行.
+# keep_preds 时同时收集每层的留出预测 [n_layers, n_sent, n_vox] (显著性检验用, 见 significance.py)
+# 与每个 (层, fold, 体素) 选中的 alpha [n_layers, n_folds, n_vox].
+# 剖析事件的 layer 标签为存储中的层位置; worker 的事件带上主进程当前阶段的标签 (run / model)
+_W = {}
+
+def _share(arr):
+    arr = np.ascontiguousarray(arr)
+    shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    np.ndarray(arr.shape, arr.dtype, buffer=shm.buf)[...] = arr
+    return shm, (shm.name, arr.shape, arr.dtype.str)
+
+def _attach(spec):
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, np.dtype(dtype), buffer=shm.buf)
+
+def _init_worker(y_spec, c_spec, feat, rows, splits, pca_n, alphas, blas_threads, keep_preds, tags):
+    _W["limits"] = threadpool_limits(blas_threads)
+    _W["shm_y"], Y = _attach(y_spec)
+    _W["shm_c"], C = _attach(c_spec)
+    X, _ = open_store(*feat)
+    # 每个 worker 只为目标端去偏一次
+    _W.update(X=X, rows=rows, folds=prepare_folds(Y, C, splits), pca_n=pca_n, alphas=alphas,
+              keep_preds=keep_preds, tags=tags, layer=(None, None))
+
+def _layer(l):
+    # 同一 worker 连续处理同一层的多个 fold 时只读取一次该层
+    if _W["layer"][0] != l:
+        with stage("layer_read", **_W["tags"], layer=l):
+            _W["layer"] = (l, np.asarray(_W["X"][:, l, :])[_W["rows"]])
+    return _W["layer"][1]
+
+def _run_task(task):
+    l, f = task
+    fold = _W["folds"][f]
+    X_layer = _layer(l)
+    with stage("fold", **_W["tags"], layer=l, fold=f):
+        preds, alpha = cv_fold_predict(X_layer, fold, _W["pca_n"], _W["alphas"])
+        score = fold_score(preds, fold[5])
+    return l, f, score, ((preds, alpha) if _W["keep_preds"] else None)
+
+def run_layer_cv(feat, rows, Y_roi, durations, n_layers, splits, pca_n, alphas, n_workers=1, blas_threads=1,
+                 keep_preds=False):
+    # feat: (folder, fname) 特征存储; rows: 与 Y_roi 各行对应的存储行号
+    # 返回 [n_layers, n_folds] 的 fold 分数; keep_preds 时返回 (分数, 留出预测, alpha)
+    scores = np.zeros((n_layers, len(splits)))
+    heldout = np.zeros((n_layers,) + Y_roi.shape, dtype=np.float32) if keep_preds else None
+    chosen = np.zeros((n_layers, len(splits), Y_roi.shape[1]), dtype=np.float32) if keep_preds else None
+    tasks = [(l, f) for l in range(n_layers) for f in range(len(splits))]
+    if n_workers <= 1:
+        X, _ = open_store(*feat)
+        folds = prepare_folds(Y_roi, durations, splits)
+        for l in range(n_layers):
+            with stage("layer_read", layer=l):
+                X_layer = np.asarray(X[:, l, :])[rows]
+            for f, fold in enumerate(folds):
+                with stage("fold", layer=l, fold=f):
+                    preds, alpha = cv_fold_predict(X_layer, fold, pca_n, alphas)
+                    scores[l, f] = fold_score(preds, fold[5])
+                if keep_preds: heldout[l, fold[1]], chosen[l, f] = preds, alpha
+        return (scores, heldout, chosen) if keep_preds else scores
+
+    shm_y, y_spec = _share(Y_roi)
+    shm_c, c_spec = _share(durations)
+    try:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                 initargs=(y_spec, c_spec, feat, rows, splits, pca_n, alphas, blas_threads,
+                                           keep_preds, current_tags())) as ex:
+            # 按层分块, 同一层的 fold 尽量落在同一个 worker
+            for l, f, score, kept in ex.map(_run_task, tasks, chunksize=len(splits)):
+                scores[l, f] = score
+                if keep_preds: heldout[l, splits[f][1]], chosen[l, f] = kept
+    finally:
+        for shm in (shm_y, shm_c):
+            shm.close(); shm.unlink()
+    return (scores, heldout, chosen) if keep_preds else scores
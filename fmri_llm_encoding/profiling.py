@@ -0,0 +1,184 @@
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import threading
+import contextlib
+import itertools
+import pandas as pd
+
+# === 阶段级计时 / 内存剖析 ===
+# with stage("load_fmri", run=15): ...  记录耗时与阶段内的 RSS 高水位, 每个阶段结束时向 JSON lines 日志追加一个事件.
+# 阶段可以嵌套: 事件带完整路径 (run/evaluate/fold/ridge), 父事件 id, 以及外层的全部标签 (run / model / layer / fold).
+# 未启用时 stage() 只多一次判断. 日志路径同时写入环境变量, 进程池 worker 追加到同一个文件
+ENV_VAR = "FMRI_PROFILE"
+SAMPLE_INTERVAL = 0.01
+
+_log = {"path": os.environ.get(ENV_VAR) or None, "fh": None, "pid": None}
+_local = threading.local()
+_active = {}
+_lock = threading.Lock()
+_sampler = {"pid": None}
+_ids = itertools.count()
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # 非 Linux 没有当前 RSS, 退回进程最高水位
+        return maxrss_bytes()
+
+def maxrss_bytes():
+    # ru_maxrss: Linux 单位 KB, macOS 为字节
+    r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return r if sys.platform == "darwin" else r * 1024
+
+class PeakRSS:
+    # 独立使用的 RSS 峰值采样 (benchmark 用); 只统计本进程, 进程池 worker 不计入
+    def __init__(self, interval=0.005):
+        self.interval = interval
+
+    def _poll(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, rss_bytes())
+
+    def __enter__(self):
+        self.start = self.peak = rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set(); self._thread.join()
+        self.peak = max(self.peak, rss_bytes())
+
+def enable(path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    _log.update(path=path, fh=None, pid=None)
+    os.environ[ENV_VAR] = path
+
+def disable():
+    if _log["fh"] is not None and _log["pid"] == os.getpid(): _log["fh"].close()
+    _log.update(path=None, fh=None, pid=None)
+    os.environ.pop(ENV_VAR, None)
+
+def enabled():
+    return _log["path"] is not None
+
+def current_tags():
+    # 当前线程最内层阶段的标签 (交给 worker 进程, 使它们的事件带上 run / model)
+    stack = getattr(_local, "stack", None)
+    return dict(stack[-1]["tags"]) if stack else {}
+
+def _write(event):
+    # 每个进程自己打开 (fork 之后重新打开); 每个事件一次追加写, 多进程的行不会交错
+    if _log["pid"] != os.getpid():
+        _log["fh"] = open(_log["path"], "a", encoding="utf-8")
+        _log["pid"] = os.getpid()
+    _log["fh"].write(json.dumps(event) + "\n")
+    _log["fh"].flush()
+
+def _sample():
+    while True:
+        time.sleep(SAMPLE_INTERVAL)
+        r = rss_bytes()
+        with _lock:
+            for fr in _active.values():
+                if r > fr["peak"]: fr["peak"] = r
+
+def _ensure_sampler():
+    # 一个后台线程为所有进行中的阶段更新 RSS 峰值; fork 出的子进程里重新启动
+    if _sampler["pid"] == os.getpid(): return
+    threading.Thread(target=_sample, daemon=True).start()
+    _sampler["pid"] = os.getpid()
+
+@contextlib.contextmanager
+def stage(name, **tags):
+    if _log["path"] is None:
+        yield
+        return
+    _ensure_sampler()
+    stack = getattr(_local, "stack", None)
+    if stack is None: stack = _local.stack = []
+    parent = stack[-1] if stack else None
+    r0 = rss_bytes()
+    fr = {"id": f"{os.getpid()}-{next(_ids)}", "path": f"{parent['path']}/{name}" if parent else name,
+          "tags": dict(parent["tags"], **tags) if parent else dict(tags), "peak": r0}
+    stack.append(fr)
+    with _lock: _active[fr["id"]] = fr
+    t_wall, t0 = time.time(), time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        seconds = time.perf_counter() - t0
+        with _lock: _active.pop(fr["id"], None)
+        stack.pop()
+        r1 = rss_bytes()
+        peak = max(fr["peak"], r1)
+        # 很短的阶段可能没被采样到, 峰值向外层传递
+        if parent is not None: parent["peak"] = max(parent["peak"], peak)
+        _write({"stage": name, "path": fr["path"], "id": fr["id"], "parent": parent["id"] if parent else None,
+                "tags": fr["tags"], "t": t_wall, "seconds": seconds,
+                "rss_start_mb": r0 / 2 ** 20, "rss_end_mb": r1 / 2 ** 20, "peak_rss_mb": peak / 2 ** 20,
+                "maxrss_mb": maxrss_bytes() / 2 ** 20, "pid": os.getpid(), "error": error})
+
+# === 汇总报告 ===
+def load_events(paths):
+    events = []
+    for p in paths:
+        with open(p, encoding="utf-8") as fh:
+            events.extend(json.loads(line) for line in fh if line.strip())
+    return events
+
+def summarize(events, by="stage"):
+    # 按阶段名 (by="stage") 或完整路径 (by="path") 汇总; 自身时间 = 总时间 - 直接子阶段时间.
+    # 按自身时间从高到低排序, share 为其占全部自身时间的比例
+    if not events: return pd.DataFrame()
+    child = {}
+    for e in events:
+        if e["parent"] is not None: child[e["parent"]] = child.get(e["parent"], 0.0) + e["seconds"]
+    df = pd.DataFrame({
+        "key": [e[by] for e in events],
+        "seconds": [e["seconds"] for e in events],
+        "self": [max(0.0, e["seconds"] - child.get(e["id"], 0.0)) for e in events],
+        "peak_rss_mb": [e["peak_rss_mb"] for e in events],
+        "rss_growth_mb": [e["rss_end_mb"] - e["rss_start_mb"] for e in events],
+    })
+    out = df.groupby("key").agg(count=("seconds", "size"), total_s=("seconds", "sum"), self_s=("self", "sum"),
+                                mean_s=("seconds", "mean"), max_s=("seconds", "max"),
+                                peak_rss_mb=("peak_rss_mb", "max"), rss_growth_mb=("rss_growth_mb", "max"))
+    out["share"] = out["self_s"] / max(out["self_s"].sum(), 1e-12)
+    return out.sort_values("self_s", ascending=False)
+
+def by_tag(events, tag, stage_name):
+    # 某个阶段按标签展开 (例如 evaluate 按 run), 看哪个 run / 模型最慢
+    rows = [(e["tags"].get(tag), e["seconds"], e["peak_rss_mb"]) for e in events
+            if e["stage"] == stage_name and tag in e["tags"]]
+    df = pd.DataFrame(rows, columns=[tag, "seconds", "peak_rss_mb"])
+    return df.groupby(tag).agg(count=("seconds", "size"), total_s=("seconds", "sum"),
+                               peak_rss_mb=("peak_rss_mb", "max")).sort_values("total_s", ascending=False)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Rank hot stages in profiling JSON-lines logs")
+    ap.add_argument("logs", nargs="+")
+    ap.add_argument("--by", choices=["stage", "path"], default="stage")
+    ap.add_argument("--top", type=int, default=20)
+    ap.add_argument("--tag", nargs=2, metavar=("TAG", "STAGE"), help="break one stage down by a tag, e.g. run evaluate")
+    ap.add_argument("--csv", default=None, help="also write the full summary to this CSV")
+    args = ap.parse_args()
+
+    events = load_events(args.logs)
+    summary = summarize(events, args.by)
+    print(f" {len(events)} events from {len(args.logs)} log(s)")
+    with pd.option_context("display.width", 200, "display.max_columns", 20, "display.float_format", "{:.3f}".format):
+        print(summary.head(args.top))
+        if args.tag: print(by_tag(events, *args.tag))
+    if args.csv: summary.to_csv(args.csv)
@@ -0,0 +1,71 @@
+import os
+import argparse
+import matplotlib
+matplotlib.use("Agg")
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import step2_encoding as s2
+import results_store
+from results_plot import line_chart, four_other_charts
+
+# === 无界面报告: 读取各模型的逐层结果, 并行渲染全部图表 ===
+# 数据优先从列式存储读取 (只读 subject / run / layer / r 四列和相关分区), 没有时退回 {name}_final_results.csv.
+# 每张图在独立进程里用 Agg 后端渲染, 只写图片文件
+FIGURES = {
+    "line": (line_chart.plot_line, "encoding_comparison_plot.png"),
+    "difference": (four_other_charts.plot_difference, "plot_A_difference.png"),
+    "heatmap": (four_other_charts.plot_heatmap, "plot_B_heatmap.png"),
+    "scatter": (four_other_charts.plot_scatter, "plot_C_scatter.png"),
+    "boxplot": (four_other_charts.plot_boxplot, "plot_D_boxplot.png"),
+}
+
+def load_table(name, source="auto", subjects=None):
+    if source in ("auto", "store") and s2.RESULTS_STORE is not None:
+        df = results_store.layer_table(s2.RESULTS_STORE, name, subjects)
+        if df is not None or source == "store": return df
+    path = os.path.join(s2.RESULTS_DIR, f"{name}_final_results.csv")
+    return pd.read_csv(path, index_col=0) if os.path.exists(path) else None
+
+def load_ci(base, other):
+    path = os.path.join(s2.RESULTS_DIR, f"{other}_minus_{base}_bootstrap.csv")
+    if not os.path.exists(path): return None
+    return pd.read_csv(path, index_col=0, usecols=["layer", "ci_low", "ci_high", "excludes_zero"])
+
+def align(base_df, other_df):
+    # 两个模型只比较共有的层和 run
+    layers = base_df.index.intersection(other_df.index)
+    cols = [c for c in base_df.columns if c in other_df.columns]
+    return base_df.loc[layers, cols], other_df.loc[layers, cols]
+
+def _render(task):
+    fig, base_df, other_df, path, dpi, ci = task
+    FIGURES[fig][0](base_df, other_df, path, dpi=dpi, ci=ci)
+    return path
+
+def render(base_df, other_df, out_dir, figures=None, ci=None, dpi=300, n_workers=None):
+    figures = figures or list(FIGURES)
+    os.makedirs(out_dir, exist_ok=True)
+    tasks = [(f, base_df, other_df, os.path.join(out_dir, FIGURES[f][1]), dpi, ci) for f in figures]
+    n_workers = max(1, min(n_workers or os.cpu_count() or 1, len(tasks)))
+    if n_workers == 1: return [_render(t) for t in tasks]
+    with ProcessPoolExecutor(max_workers=n_workers) as ex:
+        return list(ex.map(_render, tasks))
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Render the Base vs Instruct figures headlessly")
+    ap.add_argument("--pair", nargs=2, default=["Base", "Instruct"], metavar=("BASE", "OTHER"))
+    ap.add_argument("--source", choices=["auto", "store", "csv"], default="auto")
+    ap.add_argument("--subjects", nargs="+", default=None)
+    ap.add_argument("--figures", nargs="+", choices=list(FIGURES), default=None)
+    ap.add_argument("--out", default=os.path.join(s2.RESULTS_DIR, "figures"))
+    ap.add_argument("--dpi", type=int, default=300)
+    ap.add_argument("--workers", type=int, default=None)
+    args = ap.parse_args()
+
+    base, other = args.pair
+    tables = {name: load_table(name, args.source, args.subjects) for name in args.pair}
+    missing = [name for name, df in tables.items() if df is None]
+    if missing: raise SystemExit(f"no results for {', '.join(missing)}")
+    base_df, other_df = align(tables[base], tables[other])
+    paths = render(base_df, other_df, args.out, args.figures, load_ci(base, other), args.dpi, args.workers)
+    for p in paths: print(f" 已保存 {p}")
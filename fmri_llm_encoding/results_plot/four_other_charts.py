@@ -1,34 +1,31 @@
+import matplotlib
+matplotlib.use("Agg")
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 
-try:
-    base_df = pd.read_csv('Base_final_results.csv', index_col=0) 
-    instruct_df = pd.read_csv('Instruct_final_results.csv', index_col=0)
-except FileNotFoundError:
-    print("can't fine CSV")
-    runs = [f'Run{i}' for i in range(15, 24)]
-    base_df = pd.DataFrame(np.random.rand(33, 9) * 0.4, columns=runs)
-    instruct_df = base_df + np.random.normal(0, 0.02, (33, 9))
+# 四张对比图; 每个函数接收数据和输出路径, 保存后关闭图, 不弹窗口 (由 report.py 并行渲染)
+def set_style():
+    plt.style.use('seaborn-v0_8-whitegrid')
+    plt.rcParams['font.sans-serif'] = ['Arial', 'DejaVu Sans', 'sans-serif']
+    plt.rcParams['axes.unicode_minus'] = False
 
-run_cols = [col for col in base_df.columns if 'Run' in col]
-
-base_mean = base_df[run_cols].mean(axis=1)
-instruct_mean = instruct_df[run_cols].mean(axis=1)
-layers = base_df.index
-
-plt.style.use('seaborn-v0_8-whitegrid')
-plt.rcParams['font.sans-serif'] = ['Arial', 'DejaVu Sans', 'sans-serif']
-plt.rcParams['axes.unicode_minus'] = False
+def run_means(base_df, instruct_df):
+    run_cols = [col for col in base_df.columns if 'Run' in col]
+    return run_cols, base_df[run_cols].mean(axis=1), instruct_df[run_cols].mean(axis=1)
 
 # ==========================================
-# 图表 A: 差异图 (±0.1)
+# 图表 A: 差异图 (有 bootstrap 结果时画置信区间, 否则固定 ±0.1)
 # ==========================================
-def plot_difference():
+def plot_difference(base_df, instruct_df, out_path, dpi=300, ci=None):
+    # ci: significance.py 的 {other}_minus_{base}_bootstrap.csv (以层为索引)
+    set_style()
+    _, base_mean, instruct_mean = run_means(base_df, instruct_df)
+    layers = base_df.index
     diff = instruct_mean - base_mean
     
-    plt.figure(figsize=(12, 6))
+    fig = plt.figure(figsize=(12, 6))
     plt.plot(layers, diff, color='black', linewidth=1.5, label='Difference (Instruct - Base)')
     
     plt.fill_between(layers, diff, 0, where=(diff > 0), color='#d62728', alpha=0.3, label='Improvement')
@@ -36,21 +33,33 @@ def plot_difference():
     
     plt.axhline(0, color='gray', linestyle='--', linewidth=1)
     
-    plt.ylim(-0.1, 0.1) 
+    ci = ci.reindex(layers) if ci is not None else None
+    if ci is not None and ci['ci_low'].notna().any():
+        plt.fill_between(layers, ci['ci_low'], ci['ci_high'], color='gray', alpha=0.25,
+                         label='Bootstrap CI')
+        sig = ci['excludes_zero'].fillna(False).astype(bool)
+        plt.scatter(layers[sig.values], diff[sig.values], color='black', marker='*', s=60, zorder=3,
+                    label='CI excludes 0')
+        lim = max(0.1, float(np.nanmax(np.abs(ci[['ci_low', 'ci_high']].values))) * 1.1)
+        plt.ylim(-lim, lim)
+    else:
+        plt.ylim(-0.1, 0.1) 
 
     plt.xlabel('Transformer Layer', fontsize=12)
     plt.ylabel('Δ Pearson r (Instruct - Base)', fontsize=12)
     plt.title('A. Impact of Instruction Tuning across Layers', fontsize=14, fontweight='bold')
     plt.legend(loc='upper right')
     plt.tight_layout()
-    plt.savefig('plot_A_difference.png', dpi=300)
-    plt.show()
+    plt.savefig(out_path, dpi=dpi)
+    plt.close(fig)
 
 # ==========================================
 # 图表 B: 热力图
 # ==========================================
-def plot_heatmap():
-    plt.figure(figsize=(14, 6))
+def plot_heatmap(base_df, instruct_df, out_path, dpi=300, ci=None):
+    set_style()
+    run_cols, _, _ = run_means(base_df, instruct_df)
+    fig = plt.figure(figsize=(14, 6))
     vmin = base_df[run_cols].min().min()
     vmax = base_df[run_cols].max().max()
     
@@ -61,14 +70,17 @@ def plot_heatmap():
     plt.ylabel('Subject / Run ID', fontsize=12)
     plt.title('B. Encoding Performance Stability (Base Model)', fontsize=14, fontweight='bold')
     plt.tight_layout()
-    plt.savefig('plot_B_heatmap.png', dpi=300)
-    plt.show()
+    plt.savefig(out_path, dpi=dpi)
+    plt.close(fig)
 
 # ==========================================
 # 图表 C: 散点相关图
 # ==========================================
-def plot_scatter():
-    plt.figure(figsize=(8, 8))
+def plot_scatter(base_df, instruct_df, out_path, dpi=300, ci=None):
+    set_style()
+    _, base_mean, instruct_mean = run_means(base_df, instruct_df)
+    layers = base_df.index
+    fig = plt.figure(figsize=(8, 8))
     
     sc = plt.scatter(base_mean, instruct_mean, c=layers, cmap='Blues', s=100, edgecolors='k', alpha=0.8)
     
@@ -86,13 +98,15 @@ def plot_scatter():
     plt.title('C. Layer-wise Performance Comparison', fontsize=14, fontweight='bold')
     plt.legend()
     plt.tight_layout()
-    plt.savefig('plot_C_scatter.png', dpi=300)
-    plt.show()
+    plt.savefig(out_path, dpi=dpi)
+    plt.close(fig)
 
 # ==========================================
 # 图表 D: 箱线图
 # ==========================================
-def plot_boxplot():
+def plot_boxplot(base_df, instruct_df, out_path, dpi=300, ci=None):
+    set_style()
+    run_cols, _, _ = run_means(base_df, instruct_df)
     base_melt = base_df[run_cols].reset_index().melt(id_vars='index', var_name='Run', value_name='r')
     base_melt['Model'] = 'Base'
     instruct_melt = instruct_df[run_cols].reset_index().melt(id_vars='index', var_name='Run', value_name='r')
@@ -101,7 +115,7 @@ def plot_boxplot():
     combined_df = pd.concat([base_melt, instruct_melt])
     combined_df.rename(columns={'index': 'Layer'}, inplace=True)
 
-    plt.figure(figsize=(16, 7))
+    fig = plt.figure(figsize=(16, 7))
     filter_mask = combined_df['Layer'] % 2 == 0 
     sns.boxplot(x='Layer', y='r', hue='Model', data=combined_df[filter_mask], 
                 palette={'Base': '#1f77b4', 'Instruct': '#d62728'}, linewidth=1.2, fliersize=3)
@@ -112,20 +126,33 @@ def plot_boxplot():
     plt.legend(loc='upper left')
     plt.grid(axis='y', linestyle='--', alpha=0.5)
     plt.tight_layout()
-    plt.savefig('plot_D_boxplot.png', dpi=300)
-    plt.show()
+    plt.savefig(out_path, dpi=dpi)
+    plt.close(fig)
 
 if __name__ == "__main__":
+    try:
+        base_df = pd.read_csv('Base_final_results.csv', index_col=0) 
+        instruct_df = pd.read_csv('Instruct_final_results.csv', index_col=0)
+    except FileNotFoundError:
+        print("can't fine CSV")
+        runs = [f'Run{i}' for i in range(15, 24)]
+        base_df = pd.DataFrame(np.random.rand(33, 9) * 0.4, columns=runs)
+        instruct_df = base_df + np.random.normal(0, 0.02, (33, 9))
+    try:
+        ci = pd.read_csv('Instruct_minus_Base_bootstrap.csv', index_col=0)
+    except FileNotFoundError:
+        ci = None
+
     print("图表 A ")
-    plot_difference()
+    plot_difference(base_df, instruct_df, 'plot_A_difference.png', ci=ci)
     
     print("图表 B...")
-    plot_heatmap()
+    plot_heatmap(base_df, instruct_df, 'plot_B_heatmap.png')
     
     print("图表 C")
-    plot_scatter()
+    plot_scatter(base_df, instruct_df, 'plot_C_scatter.png')
     
     print("图表 D")
-    plot_boxplot()
+    plot_boxplot(base_df, instruct_df, 'plot_D_boxplot.png')
     
-    print("Done")
\ No newline at end of file
+    print("Done")
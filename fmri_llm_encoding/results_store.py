@@ -0,0 +1,82 @@
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+
+# === 列式结果存储 (Parquet, 按 model / subject / run 分区) ===
+# 每个单元 (模型, 被试, run) 完成后只写自己的分区, 不重写其它结果; 重跑同一单元时原子替换该分区的文件.
+#   layer_fold: 每 (层, fold) 一行: r (有效体素平均), 有效体素数, alpha 中位数, 以及该单元的 delay / 选择方式等
+#   voxel:      每 (层, fold, 体素) 一行: 体素展平下标, 留出 r, 选中的 alpha
+# 读取时只取需要的列, 分区列可以作为过滤条件 (只读相关分区)
+TABLES = ("layer_fold", "voxel")
+PART_FILE = "part-0.parquet"
+
+def partition_dir(root, table, name, subject, run):
+    return os.path.join(root, table, f"model={name}", f"subject={subject}", f"run={run}")
+
+def _write_part(df, path):
+    # 临时文件以 "_" 开头: 读取时 pyarrow 会忽略, 写到一半的文件不会被读到; 文件名唯一, 并发写入互不覆盖
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix="_" + os.path.basename(path) + ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp): os.remove(tmp)
+        raise
+
+def layer_fold_frame(res, voxel_r, alpha):
+    # res: evaluate_features 的结果; voxel_r / alpha: [n_layers, n_folds, n_vox]
+    n_layers, n_folds, _ = voxel_r.shape
+    fold_scores = np.asarray(res["fold_scores"])
+    return pd.DataFrame({
+        "layer": np.repeat(np.asarray(res["layers"], dtype=np.int16), n_folds),
+        "fold": np.tile(np.arange(n_folds, dtype=np.int16), n_layers),
+        "r": fold_scores.ravel(),
+        "n_valid": (~np.isnan(voxel_r)).sum(axis=2).ravel().astype(np.int32),
+        "alpha_median": np.median(alpha, axis=2).ravel(),
+    }).assign(delay=float(res["delay"]), probe_score=float(res["probe_score"]),
+              selection=res["selection"], n_sentences=int(res["n_sentences"]))
+
+def voxel_frame(res, voxel_r, alpha, voxels):
+    n_layers, n_folds, n_vox = voxel_r.shape
+    return pd.DataFrame({
+        "layer": np.repeat(np.asarray(res["layers"], dtype=np.int16), n_folds * n_vox),
+        "fold": np.tile(np.repeat(np.arange(n_folds, dtype=np.int16), n_vox), n_layers),
+        "voxel": np.tile(np.asarray(voxels, dtype=np.int64), n_layers * n_folds),
+        "r": voxel_r.ravel().astype(np.float32),
+        "alpha": alpha.ravel().astype(np.float32),
+    })
+
+def write_unit(root, name, subject, run, res, voxel_r, alpha, voxels):
+    # voxels: 各列在体积中的展平下标 (target["top_flat"])
+    frames = {"layer_fold": layer_fold_frame(res, voxel_r, alpha),
+              "voxel": voxel_frame(res, voxel_r, alpha, voxels)}
+    for table, df in frames.items():
+        _write_part(df, os.path.join(partition_dir(root, table, name, subject, run), PART_FILE))
+
+def read(root, table, columns=None, **where):
+    # where: 列 == 值, 或列 in 列表 (例如 model=["Base", "Instruct"], run=15)
+    path = os.path.join(root, table)
+    if not os.path.isdir(path): return None
+    filters = [(k, "in", list(v)) if isinstance(v, (list, tuple, set)) else (k, "==", v)
+               for k, v in where.items()] or None
+    df = pd.read_parquet(path, columns=columns, filters=filters)
+    # 分区列读回来是 category, 还原成普通类型
+    for c in df.select_dtypes("category").columns:
+        df[c] = df[c].astype(df[c].cat.categories.dtype)
+    return df
+
+def layer_table(root, name, subjects=None):
+    # 与 {name}_final_results.csv 相同的宽表: 行为层, 列为 Run{run} (多被试时 {subject}_Run{run}), 值为 fold 平均 r
+    where = {"model": name}
+    if subjects: where["subject"] = list(subjects)
+    df = read(root, "layer_fold", ["subject", "run", "layer", "r"], **where)
+    if df is None or df.empty: return None
+    mean = df.groupby(["subject", "run", "layer"])["r"].mean().reset_index()
+    multi = mean["subject"].nunique() > 1
+    mean["col"] = [f"{s}_Run{r}" if multi else f"Run{r}" for s, r in zip(mean["subject"], mean["run"])]
+    wide = mean.pivot(index="layer", columns="col", values="r")
+    wide.index.name = wide.columns.name = None
+    return wide[sorted(wide.columns, key=lambda c: (c.split("_Run")[0] if multi else "", int(c.rsplit("Run", 1)[1])))]
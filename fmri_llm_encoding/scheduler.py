@@ -0,0 +1,106 @@
+import os
+import argparse
+import traceback
+import nibabel as nib
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import step2_encoding as s2
+from fmri_prep import find_run_file
+from profiling import enable as enable_profiling
+
+# === 多被试 x run x 模型 调度 ===
+# 每个单元 (被试, run) 对所有模型运行 step2_encoding.analyze_run_multi, fMRI 端只准备一次;
+# 每个模型的结果独立写检查点, 重启时跳过已完成的部分.
+# 进程池按内存预算提交: 正在运行的单元估计内存之和不超过预算
+MODELS = {"Base": "embeddings_base", "Instruct": "embeddings_instruct"}
+# 不在 step2_encoding.SUBJECTS 里的被试按此模板找 fMRI 目录
+SUBJECT_DIR_TEMPLATE = os.path.join(s2.BASE_DIR, "fmri", "sub-{subject}")
+N_UNIT_WORKERS = max(1, (os.cpu_count() or 1) // 4)
+MEM_BUDGET_GB = 32.0
+# 单元峰值内存 ~ 系数 x 一个 run 的 float32 [n_tr, n_vox] 矩阵 (原始数据 + 标准化 + 句子级 BOLD + 中间量);
+# 设定了 step2_encoding.MEM_CAP_GB 时以该上限为准
+MEM_FACTOR = 4.0
+
+def subject_dirs(subjects):
+    return {sub: s2.SUBJECTS.get(sub, SUBJECT_DIR_TEMPLATE.format(subject=sub)) for sub in subjects}
+
+def make_units(subjects, runs):
+    return [(subject, run) for subject in subjects for run in runs]
+
+def unit_done(unit, models):
+    return all(s2.load_unit(name, *unit) is not None for name in models)
+
+def estimate_unit_bytes(fmri_dir, run):
+    # 只读 NIfTI 头, 不加载数据
+    f = find_run_file(fmri_dir, run)
+    if f is None: return 0
+    shape = nib.load(f).shape
+    n_vox = int(shape[0]) * int(shape[1]) * int(shape[2])
+    need = int(MEM_FACTOR * n_vox * shape[-1] * 4)
+    if s2.MEM_CAP_GB is not None: need = min(need, int(s2.MEM_CAP_GB * 1024 ** 3))
+    return need
+
+def run_unit(unit, models, dirs, selection, selection_ref):
+    subject, run = unit
+    feat_dirs = {n: os.path.join(s2.BASE_DIR, f) for n, f in models.items()}
+    # 单元之间已经并行, 单元内部的层 x fold 串行, 避免进程嵌套
+    done = s2.analyze_run_multi(feat_dirs, run, dirs[subject], subject, selection, selection_ref, n_workers=1)
+    return len(done) > 0
+
+def schedule(units, models, dirs, n_workers=N_UNIT_WORKERS, mem_budget_gb=MEM_BUDGET_GB,
+             selection=s2.TARGET_SELECTION, selection_ref=None):
+    # models: {名称: 特征目录名}
+    pending = [u for u in units if not unit_done(u, models)]
+    print(f" Scheduler: {len(units)} units, {len(units) - len(pending)} already done, "
+          f"{len(pending)} to run ({n_workers} workers, {mem_budget_gb:.0f} GB budget)", flush=True)
+    budget = mem_budget_gb * 1024 ** 3
+    need = {u: estimate_unit_bytes(dirs[u[0]], u[1]) for u in pending}
+    running, failed = {}, []
+    with ProcessPoolExecutor(max_workers=n_workers) as ex:
+        while pending or running:
+            used = sum(need[u] for u in running.values())
+            i = 0
+            while i < len(pending) and len(running) < n_workers:
+                u = pending[i]
+                # 没有单元在跑时总会提交一个, 单个超预算的单元也能完成
+                if not running or used + need[u] <= budget:
+                    running[ex.submit(run_unit, u, models, dirs, selection, selection_ref)] = u
+                    used += need[u]
+                    pending.pop(i)
+                else:
+                    i += 1
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                u = running.pop(fut)
+                try:
+                    ok = fut.result()
+                    print(f"   {'done' if ok else 'no data'}: {u}", flush=True)
+                except Exception:
+                    failed.append(u)
+                    print(f"   FAILED: {u}\n{traceback.format_exc()}", flush=True)
+    return failed
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Run LPP encoding analyses over subjects x runs x models")
+    ap.add_argument("--models", nargs="+", default=list(MODELS))
+    ap.add_argument("--subjects", nargs="+", default=list(s2.SUBJECTS))
+    ap.add_argument("--runs", nargs="+", type=int, default=s2.RUN_IDS)
+    ap.add_argument("--workers", type=int, default=N_UNIT_WORKERS)
+    ap.add_argument("--mem-gb", type=float, default=MEM_BUDGET_GB)
+    ap.add_argument("--selection", choices=["per-model", "shared"], default=s2.TARGET_SELECTION)
+    ap.add_argument("--selection-ref", default=None,
+                    help="required in shared mode: a compared model (biases the comparison towards it) "
+                         "or an independent feature directory that picks delay/voxels")
+    ap.add_argument("--profile", default=s2.PROFILE_LOG, help="append stage timing/memory events (JSON lines) here")
+    args = ap.parse_args()
+    if args.selection == "shared" and not args.selection_ref:
+        ap.error("--selection shared needs --selection-ref")
+    # 日志路径经环境变量传给单元 worker
+    if args.profile: enable_profiling(args.profile)
+
+    units = make_units(args.subjects, args.runs)
+    models = {n: MODELS[n] for n in args.models}
+    failed = schedule(units, models, subject_dirs(args.subjects), args.workers, args.mem_gb,
+                      args.selection, args.selection_ref)
+    for name in args.models:
+        s2.write_results_csv(name, args.subjects, args.runs)
+    if failed: print(f" {len(failed)} units failed: {failed}")
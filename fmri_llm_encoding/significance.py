@@ -0,0 +1,206 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+import step2_encoding as s2
+
+# === 显著性检验: 在 step2 保存的留出预测上计算, 不重新拟合模型 ===
+# 逐层分数与 step2 的 CV-r 相同: 每个 fold 内体素 Pearson r 的均值, 再对 fold 取平均; 多个单元 (被试 x run) 再取平均.
+# 置换检验: 每个 fold 内打乱句子 (Y 的行). 预测和目标在 fold 内只标准化一次,
+#   一批置换的所有层 / 体素的 r 是一次批量矩阵乘法. p = (1 + #{null >= obs}) / (1 + n_perm),
+#   p_fwer 用各置换跨层的最大值作零分布 (多层比较校正).
+# 配对 bootstrap: 按 fold 分层对句子做多项分布重抽样 (计数权重 W), 两个模型共用同一个 W;
+#   加权相关只需 W 与 P, P^2, Y, Y^2, P*Y 的 5 次矩阵乘法
+N_PERM = 5000
+N_BOOT = 2000
+CI_LEVEL = 0.95
+# 每批置换 / bootstrap 的个数, 限制 [批大小, 层, 体素] 中间量的内存
+CHUNK = 250
+SEED = 0
+EPS = 1e-9
+
+def load_heldout(name, subject, run):
+    path = s2.unit_path(name, subject, run, "_heldout.npz")
+    if not os.path.exists(path): return None
+    with np.load(path) as z:
+        return {k: z[k] for k in z.files}
+
+def load_units(name, subjects, runs):
+    # {(被试, run): 留出预测}; 所有单元的层必须一致
+    units = {}
+    for subject in subjects:
+        for run in runs:
+            h = load_heldout(name, subject, run)
+            if h is not None: units[(subject, run)] = h
+    layer_sets = {tuple(h["layers"].tolist()) for h in units.values()}
+    if len(layer_sets) > 1:
+        raise ValueError(f"{name}: held-out predictions have different layer sets {sorted(layer_sets)}")
+    return units
+
+def _standardize(A):
+    # 沿句子轴 (倒数第二维) 中心化并缩放到单位范数, 点积即 Pearson r; 近似常数的列置 0 并标为无效
+    c = A - A.mean(axis=-2, keepdims=True)
+    std = np.sqrt((c * c).mean(axis=-2))
+    valid = std > EPS
+    norm = np.where(valid, std * np.sqrt(A.shape[-2]), 1.0)
+    return np.where(valid[..., None, :], c / norm[..., None, :], 0.0), valid
+
+def _voxel_mean(r, valid):
+    # 有效体素上的平均 r; 没有有效体素时为 0 (同 encoding_utils.fold_score)
+    cnt = valid.sum(axis=-1)
+    return np.where(cnt > 0, np.where(valid, r, 0.0).sum(axis=-1) / np.maximum(cnt, 1), 0.0)
+
+def _fold_data(h):
+    # 每个 fold: (测试行, 标准化后的预测 [L, n_f, v], 标准化后的目标 [n_f, v], 有效体素 [L, v])
+    P, Y = h["preds"].astype(np.float64), h["Y"].astype(np.float64)
+    out = []
+    for f in np.unique(h["fold"]):
+        idx = np.flatnonzero(h["fold"] == f)
+        Pz, vp = _standardize(P[:, idx])
+        Yz, vy = _standardize(Y[idx])
+        out.append((idx, Pz, Yz, vp & vy[None, :]))
+    return out
+
+def permutation_null(h, n_perm=N_PERM, rng=None, chunk=CHUNK):
+    # 一个单元: 返回 (obs [L], null [n_perm, L])
+    rng = rng if rng is not None else np.random.default_rng(SEED)
+    folds = _fold_data(h)
+    n_layers = h["preds"].shape[0]
+    obs, null = np.zeros(n_layers), np.zeros((n_perm, n_layers))
+    for idx, Pz, Yz, valid in folds:
+        obs += _voxel_mean(np.einsum("lnv,nv->lv", Pz, Yz), valid)
+        Pt = Pz.transpose(2, 0, 1)
+        for k0 in range(0, n_perm, chunk):
+            k = min(chunk, n_perm - k0)
+            perms = rng.permuted(np.tile(np.arange(len(idx)), (k, 1)), axis=1)
+            # [v, L, n] @ [v, n, k] -> [v, L, k]
+            r = (Pt @ Yz[perms].transpose(2, 1, 0)).transpose(2, 1, 0)
+            null[k0:k0 + k] += _voxel_mean(r, valid[None])
+    return obs / len(folds), null / len(folds)
+
+def permutation_test(name, subjects, runs, n_perm=N_PERM, seed=SEED):
+    units = load_units(name, subjects, runs)
+    if not units: return None
+    rng = np.random.default_rng(seed)
+    obs, null = 0.0, 0.0
+    for h in units.values():
+        o, n = permutation_null(h, n_perm, rng)
+        obs, null = obs + o, null + n
+    obs, null = obs / len(units), null / len(units)
+    null_max = null.max(axis=1)
+    layers = next(iter(units.values()))["layers"]
+    return pd.DataFrame({
+        "score": obs,
+        "null_mean": null.mean(axis=0),
+        "null_q95": np.quantile(null, 0.95, axis=0),
+        "p_perm": (1 + (null >= obs).sum(axis=0)) / (1 + n_perm),
+        "p_fwer": (1 + (null_max[:, None] >= obs).sum(axis=0)) / (1 + n_perm),
+    }, index=pd.Index(layers, name="layer")).assign(n_units=len(units))
+
+def _weighted_r(W, Pz, Yz, valid):
+    # 计数权重 W [B, n] 下每层每体素的加权 Pearson r 的体素平均 -> [B, L]
+    n_layers, n, v = Pz.shape
+    Pm = Pz.transpose(1, 0, 2).reshape(n, n_layers * v)
+    PYm = (Pz * Yz).transpose(1, 0, 2).reshape(n, n_layers * v)
+    S = W.sum(axis=1)[:, None, None]
+    Sp = (W @ Pm).reshape(-1, n_layers, v)
+    Spp = (W @ (Pm * Pm)).reshape(-1, n_layers, v)
+    Spy = (W @ PYm).reshape(-1, n_layers, v)
+    Sy = (W @ Yz)[:, None, :]
+    Syy = (W @ (Yz * Yz))[:, None, :]
+    cov = Spy - Sp * Sy / S
+    vp = Spp - Sp * Sp / S
+    vy = Syy - Sy * Sy / S
+    ok = valid[None] & (vp > EPS ** 2 * S) & (vy > EPS ** 2 * S)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r = cov / np.sqrt(vp * vy)
+    return _voxel_mean(np.clip(r, -1.0, 1.0), ok)
+
+def _model_stat(W, folds):
+    # W 的列对应本模型的句子行; 返回 [B, L] 的 fold 平均分数
+    return sum(_weighted_r(W[:, idx], Pz, Yz, valid) for idx, Pz, Yz, valid in folds) / len(folds)
+
+def _row_weights(W, common, ids):
+    # 共同句子上的权重映射到某个模型的行; 不在共同集合中的句子权重为 0
+    pos = np.clip(np.searchsorted(common, ids), 0, len(common) - 1)
+    hit = common[pos] == ids
+    Wm = np.zeros((W.shape[0], len(ids)))
+    Wm[:, hit] = W[:, pos[hit]]
+    return Wm
+
+def paired_bootstrap(base, other, subjects, runs, n_boot=N_BOOT, level=CI_LEVEL, seed=SEED, chunk=CHUNK):
+    # other - base 的逐层差异与置信区间; 单元与层取两个模型共有的部分, 句子按 id 配对
+    ua, ub = load_units(base, subjects, runs), load_units(other, subjects, runs)
+    keys = [k for k in ua if k in ub]
+    if not keys: return None
+    la, lb = ua[keys[0]]["layers"], ub[keys[0]]["layers"]
+    layers = np.intersect1d(la, lb)
+    ia, ib = np.searchsorted(la, layers), np.searchsorted(lb, layers)
+    rng = np.random.default_rng(seed)
+
+    prepared = []
+    for k in keys:
+        ha, hb = ua[k], ub[k]
+        common = np.intersect1d(ha["ids"], hb["ids"])
+        # 分层: 按 base 模型的 fold
+        fold_of = dict(zip(ha["ids"].tolist(), ha["fold"].tolist()))
+        strata = np.array([fold_of[i] for i in common.tolist()])
+        prepared.append((common, [np.flatnonzero(strata == s) for s in np.unique(strata)],
+                         ha, _fold_data(ha), hb, _fold_data(hb)))
+
+    def diff(W_of):
+        d = 0.0
+        for (common, groups, ha, fa, hb, fb), W in zip(prepared, W_of):
+            sa = _model_stat(_row_weights(W, common, ha["ids"]), fa)[:, ia]
+            sb = _model_stat(_row_weights(W, common, hb["ids"]), fb)[:, ib]
+            d = d + (sb - sa)
+        return d / len(prepared)
+
+    obs = diff([np.ones((1, len(p[0]))) for p in prepared])[0]
+    boot = np.zeros((n_boot, len(layers)))
+    for k0 in range(0, n_boot, chunk):
+        k = min(chunk, n_boot - k0)
+        W_of = []
+        for common, groups, *_ in prepared:
+            W = np.zeros((k, len(common)))
+            for g in groups:
+                W[:, g] = rng.multinomial(len(g), np.full(len(g), 1.0 / len(g)), size=k)
+            W_of.append(W)
+        boot[k0:k0 + k] = diff(W_of)
+    lo, hi = np.quantile(boot, [(1 - level) / 2, (1 + level) / 2], axis=0)
+    return pd.DataFrame({
+        "diff": obs,
+        "ci_low": lo,
+        "ci_high": hi,
+        "boot_se": boot.std(axis=0, ddof=1),
+        "excludes_zero": (lo > 0) | (hi < 0),
+    }, index=pd.Index(layers, name="layer")).assign(n_units=len(keys))
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Permutation tests and paired bootstrap CIs on step2 held-out predictions")
+    ap.add_argument("--models", nargs="+", default=["Base", "Instruct"])
+    ap.add_argument("--pair", nargs=2, default=["Base", "Instruct"], metavar=("BASE", "OTHER"),
+                    help="bootstrap CI for OTHER - BASE")
+    ap.add_argument("--subjects", nargs="+", default=list(s2.SUBJECTS))
+    ap.add_argument("--runs", nargs="+", type=int, default=s2.RUN_IDS)
+    ap.add_argument("--n-perm", type=int, default=N_PERM)
+    ap.add_argument("--n-boot", type=int, default=N_BOOT)
+    ap.add_argument("--level", type=float, default=CI_LEVEL)
+    ap.add_argument("--seed", type=int, default=SEED)
+    ap.add_argument("--out", default=s2.RESULTS_DIR)
+    args = ap.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    for name in args.models:
+        df = permutation_test(name, args.subjects, args.runs, args.n_perm, args.seed)
+        if df is None:
+            print(f" {name}: no held-out predictions found"); continue
+        df.to_csv(os.path.join(args.out, f"{name}_significance.csv"))
+        print(f" {name}: {int((df['p_fwer'] < 0.05).sum())}/{len(df)} layers with p_fwer < 0.05")
+    base, other = args.pair
+    df = paired_bootstrap(base, other, args.subjects, args.runs, args.n_boot, args.level, args.seed)
+    if df is None:
+        print(f" {other} - {base}: no runs with held-out predictions for both models")
+    else:
+        df.to_csv(os.path.join(args.out, f"{other}_minus_{base}_bootstrap.csv"))
+        print(f" {other} - {base}: {int(df['excludes_zero'].sum())}/{len(df)} layers with CI excluding 0")
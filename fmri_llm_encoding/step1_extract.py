@@ -2,9 +2,11 @@ import os
 import glob
 import numpy as np
 import torch
-import parselmouth
-from parselmouth.praat import call
 from transformers import AutoModelForCausalLM, AutoTokenizer
+from emb_store import write_store
+from textgrid_io import sentence_texts
+from extract_cache import ExtractCache, MISS, cache_key, model_identity
+from profiling import stage, enable as enable_profiling
 
 # ===  配置 ===
 BASE_DIR = "/root/autodl-tmp/project_data"
@@ -14,23 +16,33 @@ MODEL_PATHS = {
     "Base": "/root/autodl-tmp/models/LLM-Research/Meta-Llama-3.1-8B",
     "Instruct": "/root/autodl-tmp/models_instruct/LLM-Research/Meta-Llama-3.1-8B-Instruct"
 }
+CACHE_DIR = os.path.join(BASE_DIR, "extract_cache")
 TOKEN_BEGIN = "Ġ"
+# 批处理: 每批最多句子数 / 每批 padded token 预算 (batch * max_len)
+BATCH_SIZE = 16
+MAX_BATCH_TOKENS = 2048
+# 提取模式: "sentence" 逐句独立编码; "context" 整个 section 流式通过模型, 复用 KV cache
+EXTRACT_MODE = "sentence"
+CONTEXT_WINDOW = 1024  # context 模式保留的 KV token 数 (含开头的 BOS sink)
+# 只保留的 hidden state 层 (0 = embedding), None 为全部; 最深层低于顶层时提前结束前向
+LAYERS = None
+# 运行后端: DEVICE=None 自动选择 (有 GPU 用 cuda); DTYPE=None 时 GPU 用 bfloat16, CPU 用 float32
+DEVICE = None
+DTYPE = None
+CPU_THREADS = None   # CPU 线程数, None 为 torch 默认
+QUANTIZE_INT8 = False  # 仅 CPU: Linear 层动态 int8 量化
+PROFILE_LOG = None  # 阶段计时 / 内存剖析日志 (JSON lines, 见 profiling.py); None 不记录
+# 特征: "hidden" 为 hidden state 的 mean pooling; "attn" 为逐层逐头的注意力摘要 (见 attn_summary),
+# 输出到 embeddings_*_attn. attn 只支持逐句模式
+FEATURES = "hidden"
+# attn 特征写入的统计量及顺序 (ATTN_STAT_NAMES 的子集); 列布局 (统计量, 头) 记录在存储索引的 "features" 中
+ATTN_STAT_NAMES = ("prev_word", "self_word", "bos", "entropy", "distance")
+ATTN_STATS = ATTN_STAT_NAMES
 
 # ===  辅助函数 ===
 def parse_textgrid(tg_path):
-    try:
-        tg = parselmouth.read(tg_path)
-        n = call(tg, "Get number of intervals", 1)
-        sents, curr = [], []
-        for i in range(1, int(n) + 1):
-            lbl = call(tg, "Get label of interval", 1, i).strip()
-            if not lbl: continue
-            if lbl == "#":
-                if curr: sents.append(" ".join(curr)); curr = []
-            elif lbl not in ["<sil>", "sp", "SIL"]: curr.append(lbl)
-        if curr: sents.append(" ".join(curr))
-        return sents
-    except: return []
+    # 句子文本 (单词以空格连接), 解析规则见 textgrid_io
+    return sentence_texts(tg_path)
 
 def token_groups_robust(words, tokens):
     groups = []
@@ -53,80 +65,399 @@ def token_groups_robust(words, tokens):
     if id_buf: groups.append(id_buf)
     return groups
 
-# === 提取器 (Mean Pooling Mode) ===
+def pooling_weights(groups, n_tok, offset=0):
+    # token->word->sentence 两级平均 = 对 token 的一个加权和
+    # offset: BOS 偏移; 越界 token 丢弃, 无有效单词时退回最后一个 token
+    w = np.zeros(n_tok, dtype=np.float32)
+    valid = [[offset + i for i in g if offset + i < n_tok] for g in groups]
+    valid = [g for g in valid if g]
+    if not valid:
+        w[n_tok - 1] = 1.0 # Fallback
+        return w
+    for g in valid:
+        w[g] += 1.0 / (len(g) * len(valid))
+    return w
+
+def word_matrices(groups, n_tok, offset=0, n_words=None):
+    # 单词 x token 矩阵: Q 每行为该单词 token 的平均权重, K 为单词成员 (0/1)
+    # offset / 越界处理同 pooling_weights; 没有有效 token 的单词 (及补齐的单词) 为全 0 行
+    Q = np.zeros((n_words or len(groups), n_tok), dtype=np.float32)
+    K = np.zeros_like(Q)
+    for w, g in enumerate(groups):
+        g = [offset + i for i in g if offset + i < n_tok]
+        if not g: continue
+        Q[w, g] = 1.0 / len(g)
+        K[w, g] = 1.0
+    return Q, K
+
+def attn_summary(attn, Q, K, stats=ATTN_STATS, eps=1e-12):
+    # attn: 一层的注意力 [Batch, Heads, Seq(query), Seq(key)]; Q / K: [Batch, Words, Seq] (word_matrices)
+    # 每个头对句内单词取平均的统计量 (ATTN_STAT_NAMES): 对前一个单词 / 本单词 / 开头 token (BOS) 的注意力,
+    # 注意力熵, 平均回看距离 (token 数). 只计算 stats 中的项, 返回 [Batch, len(stats) * Heads], 按 (统计量, 头) 展平
+    unknown = [k for k in stats if k not in ATTN_STAT_NAMES]
+    if unknown: raise ValueError(f"unknown attention stats {unknown}, expected a subset of {ATTN_STAT_NAMES}")
+    A = attn.float()
+    valid = K.sum(-1) > 0
+    n_words = valid.sum(-1).clamp(min=1)
+    # 单词 (token 平均) 的注意力分布 [B, H, W, Seq] 与 单词 -> 单词 的注意力质量 [B, H, W, W]
+    QA = torch.einsum("bwq,bhqk->bhwk", Q, A)
+    M = QA @ K.transpose(1, 2)[:, None]
+    pos = torch.arange(A.shape[-1], device=A.device, dtype=A.dtype)
+    word_mean = lambda x, mask, n: (x * mask[:, None]).sum(-1) / n[:, None]
+    token_mean = lambda x: word_mean(torch.einsum("bwq,bhq->bhw", Q, x), valid, n_words)
+    prev = valid[:, 1:] & valid[:, :-1]
+    compute = {
+        "prev_word": lambda: word_mean(M.diagonal(-1, -2, -1), prev, prev.sum(-1).clamp(min=1)),
+        "self_word": lambda: word_mean(M.diagonal(0, -2, -1), valid, n_words),
+        "bos": lambda: word_mean(QA[..., 0], valid, n_words),
+        "entropy": lambda: token_mean(-(A * torch.log(A.clamp(min=eps))).sum(-1)),
+        "distance": lambda: token_mean((A * (pos[:, None] - pos[None, :]).clamp(min=0)).sum(-1)),
+    }
+    return torch.stack([compute[k]() for k in stats], 1).flatten(1)
+
+def make_batches(lengths, batch_size=BATCH_SIZE, max_tokens=MAX_BATCH_TOKENS):
+    # 按长度分桶: 排序后贪心装批, 控制句子数和 padding 后的 token 总数
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches, cur = [], []
+    for i in order:
+        if cur and (len(cur) >= batch_size or (len(cur) + 1) * lengths[i] > max_tokens):
+            batches.append(cur); cur = []
+        cur.append(i)
+    if cur: batches.append(cur)
+    return batches
+
+def kv_length(past):
+    if past is None: return 0
+    if hasattr(past, "get_seq_length"): return past.get_seq_length()
+    return past[0][0].shape[-2]
+
+def trim_kv_cache(past, window, n_sink=1):
+    # 滑动窗口: 保留开头 n_sink 个 token (BOS) + 最近的 window - n_sink 个
+    # RoPE 位置已写入 key, 后续 chunk 用显式 position_ids 续接
+    if past is None or kv_length(past) <= window: return past
+    keep = window - n_sink
+    trim = lambda t: torch.cat([t[..., :n_sink, :], t[..., -keep:, :]], dim=-2)
+    if isinstance(past, tuple):
+        return tuple((trim(k), trim(v)) for k, v in past)
+    if hasattr(past, "layers"): # transformers >= 4.56
+        for lyr in past.layers:
+            lyr.keys, lyr.values = trim(lyr.keys), trim(lyr.values)
+    else:
+        past.key_cache = [trim(k) for k in past.key_cache]
+        past.value_cache = [trim(v) for v in past.value_cache]
+    return past
+
+# === 提取器 (Mean Pooling / 注意力摘要) ===
 class Extractor:
-    def __init__(self, path):
+    def __init__(self, path, layers=LAYERS, device=DEVICE, dtype=DTYPE, threads=CPU_THREADS, quantize=QUANTIZE_INT8,
+                 features=FEATURES, attn_stats=ATTN_STATS):
         print(f"Loading {os.path.basename(path)}...", flush=True)
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        if features not in ("hidden", "attn"): raise ValueError(f"unknown features {features!r}")
+        self.features = features
+        self.attn_stats = tuple(attn_stats)
+        unknown = [k for k in self.attn_stats if k not in ATTN_STAT_NAMES]
+        if features == "attn" and (unknown or not self.attn_stats):
+            raise ValueError(f"attn_stats must be a non-empty subset of {ATTN_STAT_NAMES}, got {self.attn_stats}")
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        if isinstance(dtype, str): dtype = getattr(torch, dtype)
+        # 注意力权重只有 eager 实现会返回 (sdpa / flash 不显式构造注意力矩阵)
+        extra = {"attn_implementation": "eager"} if features == "attn" else {}
         self.tokenizer = AutoTokenizer.from_pretrained(path)
-        self.model = AutoModelForCausalLM.from_pretrained(
-            path, 
-            torch_dtype=torch.bfloat16, 
-            device_map="auto", 
-            output_hidden_states=True, 
-            trust_remote_code=True
-        )
+        if self.device == "cpu":
+            if threads: torch.set_num_threads(threads)
+            # 动态量化要求 float32 权重
+            if quantize and dtype not in (None, torch.float32):
+                raise ValueError(f"int8 dynamic quantization needs float32 weights, got {dtype}")
+            dtype = dtype or torch.float32
+            self.model = AutoModelForCausalLM.from_pretrained(
+                path, 
+                torch_dtype=dtype, 
+                output_hidden_states=True, 
+                trust_remote_code=True,
+                **extra
+            )
+            if quantize:
+                # 动态量化的激活 scale 按整个输入张量选取: 批处理时句向量会依赖同批的其它句子, 见 _process_batch
+                torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        else:
+            if quantize: raise ValueError("int8 dynamic quantization is only supported on CPU")
+            dtype = dtype or torch.bfloat16
+            self.model = AutoModelForCausalLM.from_pretrained(
+                path, 
+                torch_dtype=dtype, 
+                device_map="auto", 
+                output_hidden_states=True, 
+                trust_remote_code=True,
+                **extra
+            )
         self.model.eval()
+        # 缓存 key 的组成部分 (dtype / 量化会改变输出)
+        self.quantized = quantize
+        self.identity = f"{model_identity(path, self.model.config)}-{str(dtype).replace('torch.', '')}" + ("-int8" if quantize else "")
+        # 统计量的选择与顺序是缓存 key 的一部分
+        self.pooling = "mean" if features == "hidden" else "attn-" + "-".join(self.attn_stats)
+        self.n_layers = self.model.config.num_hidden_layers
+        self.layers = None if layers is None else sorted(set(int(l) for l in layers))
+        if self.layers is not None:
+            if not self.layers or self.layers[0] < 0 or self.layers[-1] > self.n_layers:
+                raise ValueError(f"layers must be within 0..{self.n_layers}, got {self.layers}")
+            if self.layers[-1] < self.n_layers: self._truncate(self.layers[-1])
+        # 直接调用主干: 不计算 lm_head 的词表 logits
+        self.backbone = getattr(self.model, "model", self.model)
+        if features == "attn":
+            # 第 i 个 decoder 层的注意力对应层号 i + 1 (与 hidden_states 的编号一致, 0 = embedding 没有注意力)
+            if not self.layer_ids: raise ValueError("attention features need at least one decoder layer (>= 1)")
+            self._attn = None
+            for i, lyr in enumerate(self.backbone.layers):
+                lyr.self_attn.register_forward_hook(self._attn_hook(i + 1))
 
-    def process(self, text):
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        # 右侧 padding: 因果注意力下真实 token 的位置与单句路径一致
+        self.tokenizer.padding_side = "right"
+
+    def _truncate(self, top):
+        # 提前退出: 只保留前 top 个 decoder 层, 最终 norm 换成 Identity,
+        # 使 hidden_states[top] 与完整前向中的第 top 层 (未 norm) 一致
+        body = self.model.model
+        body.layers = body.layers[:top]
+        body.norm = torch.nn.Identity()
+        self.model.config.num_hidden_layers = top
+        if getattr(self.model.config, "layer_types", None):
+            self.model.config.layer_types = self.model.config.layer_types[:top]
+
+    @property
+    def layer_ids(self):
+        ids = list(range(self.n_layers + 1)) if self.layers is None else list(self.layers)
+        return [l for l in ids if l > 0] if self.features == "attn" else ids
+
+    @property
+    def feature_names(self):
+        # 最后一维各列的含义: attn 为 "统计量/h头" (按统计量、再按头); hidden 为 None (hidden state 维度)
+        if self.features != "attn": return None
+        return [f"{k}/h{h}" for k in self.attn_stats for h in range(self.model.config.num_attention_heads)]
+
+    def _attn_hook(self, layer):
+        # 注意力权重 [B, H, T, T] 在本层内立即归约为单词级摘要; 输出中的权重置为 None,
+        # 不随 outputs 逐层累积, 峰值内存只有一层的注意力
+        def hook(module, args, output):
+            if not isinstance(output, tuple) or len(output) < 2 or output[1] is None: return None
+            ctx = self._attn
+            if ctx is not None and layer in ctx["layers"]:
+                ctx["out"][layer] = attn_summary(output[1], ctx["Q"], ctx["K"], self.attn_stats)
+            return (output[0], None) + tuple(output[2:])
+        return hook
+
+    def _attn_forward(self, preps, input_ids, attention_mask=None):
+        # 一次前向, 由 hook 收集各层摘要 -> [Batch, Layers, len(attn_stats) * Heads]; 不保留 hidden states
+        n_tok, n_words = input_ids.shape[1], max(len(p[1]) for p in preps)
+        mats = [word_matrices(groups, n_tok, 1 if has_bos else 0, n_words) for _, groups, has_bos in preps]
+        as_t = lambda a: torch.as_tensor(np.stack(a), device=self.device)
+        self._attn = {"Q": as_t([q for q, _ in mats]), "K": as_t([k for _, k in mats]),
+                      "layers": set(self.layer_ids), "out": {}}
+        try:
+            self.backbone(input_ids=input_ids, attention_mask=attention_mask,
+                          output_attentions=True, output_hidden_states=False)
+            out = self._attn["out"]
+        finally:
+            self._attn = None
+        missing = [l for l in self.layer_ids if l not in out]
+        if missing: raise RuntimeError(f"no attention weights captured for layers {missing}; eager attention is required")
+        feats = torch.stack([out[l] for l in self.layer_ids], 1).cpu().numpy()
+        assert feats.shape[-1] == len(self.feature_names), (feats.shape, len(self.feature_names))
+        return feats
+
+    def _prepare(self, text):
+        return self._align(text, self.tokenizer(text).input_ids)
+
+    def _align(self, text, ids):
         words = text.strip().split()
         if len(words) < 2: return None
-        inputs = self.tokenizer(text, return_tensors="pt").to(self.device)
-        raw_tokens = self.tokenizer.convert_ids_to_tokens(inputs.input_ids[0])
-        has_bos = (raw_tokens and (raw_tokens[0] == '<|begin_of_text|>' or inputs.input_ids[0][0] == 128000))
+        raw_tokens = self.tokenizer.convert_ids_to_tokens(ids)
+        has_bos = (raw_tokens and (raw_tokens[0] == '<|begin_of_text|>' or ids[0] == 128000))
         tokens_align = raw_tokens[1:] if has_bos else raw_tokens
         
         groups = token_groups_robust(words, tokens_align)
         if len(groups) != len(words): return None
+        return ids, groups, has_bos
 
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-        
-        # [Layers, Seq, Dim]
-        all_states = torch.stack(outputs.hidden_states).squeeze(1).float().cpu().numpy()
-        if has_bos: all_states = all_states[:, 1:, :]
-        
-        layers_data = []
-        for l in range(all_states.shape[0]):
-            layer_embs = all_states[l]
+    def _weights(self, prep):
+        ids, groups, has_bos = prep
+        return pooling_weights(groups, len(ids), 1 if has_bos else 0)
+
+    def _pool(self, hidden_states, weights):
+        # hidden_states: L x [Batch, Seq, Dim]; weights: [Batch, Seq], padding 处为 0
+        # 所有层一次张量运算在设备上完成, 只把 [Batch, Layers, Dim] 拷回 CPU
+        states = torch.stack([hidden_states[l] for l in self.layer_ids])
+        w = torch.as_tensor(weights, device=states.device, dtype=torch.float32)
+        pooled = torch.einsum("lbsd,bs->bld", states.float(), w)
+        return pooled.cpu().numpy()
+
+    def process(self, text):
+        with stage("extract.process"):
+            with stage("tokenize"):
+                prep = self._prepare(text)
+            if prep is None: return None
+            input_ids = torch.tensor([prep[0]], device=self.device)
+
+            if self.features == "attn":
+                with stage("forward", n_tokens=len(prep[0])), torch.inference_mode():
+                    return self._attn_forward([prep], input_ids)[0]
+
+            with stage("forward", n_tokens=len(prep[0])), torch.inference_mode():
+                outputs = self.backbone(input_ids=input_ids)
             
-            # 1. 单词级平均
-            word_embs = []
-            for group in groups:
-                valid_idx = [i for i in group if i < layer_embs.shape[0]]
-                if valid_idx:
-                    word_embs.append(np.mean(layer_embs[valid_idx], axis=0))
+            # [Layers, Dim]
+            with stage("pool"):
+                return self._pool(outputs.hidden_states, self._weights(prep)[None])[0]
+
+    def process_batch(self, texts, batch_size=BATCH_SIZE, max_tokens=MAX_BATCH_TOKENS, on_batch=None):
+        # 与 process 逐句结果一致; 返回与 texts 对齐的列表, 跳过的句子为 None.
+        # on_batch([(下标, 结果), ...]): 每批完成后立即回调 (跳过的句子在分词后先回调一次), 用于逐批写缓存
+        with stage("extract.batch", n_sentences=len(texts)):
+            return self._process_batch(texts, batch_size, max_tokens, on_batch)
+
+    def _process_batch(self, texts, batch_size, max_tokens, on_batch=None):
+        results = [None] * len(texts)
+        with stage("tokenize"):
+            preps = [(i, p) for i, p in enumerate(self._prepare(t) for t in texts) if p is not None]
+        if on_batch is not None and len(preps) < len(texts):
+            kept = {i for i, _ in preps}
+            on_batch([(i, None) for i in range(len(texts)) if i not in kept])
+        if not preps: return results
+        
+        # 量化模型逐句前向: 结果与同批句子无关, 与 process 一致 (缓存 key 不含批次组成)
+        if self.quantized: batch_size = 1
+        for batch in make_batches([len(p[0]) for _, p in preps], batch_size, max_tokens):
+            items = [preps[j] for j in batch]
+            max_len = max(len(p[0]) for _, p in items)
+            pad_id = self.tokenizer.pad_token_id
+            input_ids = torch.full((len(items), max_len), pad_id, dtype=torch.long)
+            attn_mask = torch.zeros((len(items), max_len), dtype=torch.long)
+            # padding 位置权重为 0, 不参与 pooling
+            weights = np.zeros((len(items), max_len), dtype=np.float32)
+            for b, (_, prep) in enumerate(items):
+                ids = prep[0]
+                input_ids[b, :len(ids)] = torch.tensor(ids)
+                attn_mask[b, :len(ids)] = 1
+                weights[b, :len(ids)] = self._weights(prep)
+
+            with stage("forward", batch=len(items), n_tokens=len(items) * max_len), torch.inference_mode():
+                if self.features == "attn":
+                    pooled = self._attn_forward([p for _, p in items], input_ids.to(self.device),
+                                                attn_mask.to(self.device))
+                else:
+                    outputs = self.backbone(input_ids=input_ids.to(self.device),
+                                            attention_mask=attn_mask.to(self.device))
             
-            # 2. 句子级平均 (Mean Pooling)
-            if word_embs:
-                sent_emb = np.mean(np.vstack(word_embs), axis=0)
-                layers_data.append(sent_emb)
-            else:
-                layers_data.append(layer_embs[-1]) # Fallback
-                
-        return np.array(layers_data)
+            # [Batch, Layers, Dim]
+            if self.features != "attn":
+                with stage("pool"):
+                    pooled = self._pool(outputs.hidden_states, weights)
+            for b, (i, _) in enumerate(items):
+                results[i] = pooled[b]
+            if on_batch is not None: on_batch([(i, results[i]) for i, _ in items])
+        return results
+
+    def process_section(self, sents, window=CONTEXT_WINDOW):
+        # 注意力摘要按句内 token 位置定义, KV 裁剪后的键位置不连续, 只支持逐句模式
+        if self.features == "attn": raise ValueError("attention features are only supported in sentence mode")
+        with stage("extract.section", n_sentences=len(sents), window=window):
+            return self._process_section(sents, window)
+
+    def _process_section(self, sents, window):
+        # 整个 section 只过一遍模型: 每句作为一个 chunk 接在前文 KV cache 之后,
+        # 取出本句的 hidden states 按单词分组 pooling. 被跳过的句子也要送入模型以保持上下文
+        results = [None] * len(sents)
+        past, pos = None, 0
+        for i, text in enumerate(sents):
+            # 首句带 BOS; 之后的句子以空格开头, 分词与句中单词一致 (Ġ 前缀)
+            ids = self.tokenizer((" " if i else "") + text, add_special_tokens=(i == 0)).input_ids
+            if not ids: continue
+            n_past = kv_length(past)
+            input_ids = torch.tensor([ids], device=self.device)
+            position_ids = torch.arange(pos, pos + len(ids), device=self.device)[None]
+            attn_mask = torch.ones((1, n_past + len(ids)), dtype=torch.long, device=self.device)
+
+            with stage("forward", sent=i, n_tokens=len(ids), n_past=n_past), torch.inference_mode():
+                outputs = self.backbone(input_ids=input_ids, attention_mask=attn_mask,
+                                        position_ids=position_ids, past_key_values=past, use_cache=True)
+            past = trim_kv_cache(outputs.past_key_values, window)
+            pos += len(ids)
+
+            prep = self._align(text, ids)
+            if prep is not None:
+                with stage("pool"):
+                    results[i] = self._pool(outputs.hidden_states, self._weights(prep)[None])[0]
+        return results
 
-def run(key):
-    # 输出到 embeddings_base / embeddings_instruct
-    out = os.path.join(BASE_DIR, f"embeddings_{key.lower()}")
+def run(key, mode=EXTRACT_MODE, features=FEATURES):
+    # 输出到 embeddings_base / embeddings_instruct (context 模式加 _context 后缀, 注意力特征加 _attn 后缀)
+    # 在任何缓存查询之前拒绝: 否则命中的 context 缓存会绕过 process_section 的检查
+    if features == "attn" and mode == "context":
+        raise ValueError("attention features are only supported in sentence mode")
+    out = os.path.join(BASE_DIR, f"embeddings_{key.lower()}" + ("_context" if mode == "context" else "")
+                       + ("_attn" if features == "attn" else ""))
     os.makedirs(out, exist_ok=True)
     
-    ext = Extractor(MODEL_PATHS[key])
+    if PROFILE_LOG: enable_profiling(PROFILE_LOG)
+    with stage("load_model", model=key):
+        ext = Extractor(MODEL_PATHS[key], features=features)
+    # 窗口在运行时读取一次, 缓存 key 与 process_section 使用同一个值
+    window = CONTEXT_WINDOW
+    # 在特征类型之上加 context 标记, 不同特征的 context 缓存条目互不混用
+    if mode == "context": ext.pooling = f"{ext.pooling}-context{window}"
     files = sorted(glob.glob(os.path.join(TEXTGRID_DIR, "*.TextGrid")))
     cnt = 0
     
-    print(f"Start processing {key} (Mean Pooling)...")
+    cache = ExtractCache(os.path.join(CACHE_DIR, key.lower()))
+    print(f"Start processing {key} ({'Mean Pooling' if features == 'hidden' else 'Attention Summary'}, mode={mode}, batch={BATCH_SIZE})...")
     for f in files:
         fname = os.path.basename(f)
-        for i, sent in enumerate(parse_textgrid(f)):
-            # 检查是否已存在，避免重复跑 (可选)
-            # if os.path.exists(os.path.join(out, f"{fname}_sent{i}.npy")): continue
-            
-            res = ext.process(sent)
-            if res is not None:
-                np.save(os.path.join(out, f"{fname}_sent{i}.npy"), res)
-                cnt += 1
-    print(f" {key} Done: {cnt} sentences.")
+        sents = parse_textgrid(f)
+        with stage("section", model=key, section=fname, n_sentences=len(sents), mode=mode):
+            if mode == "context":
+                # 句向量依赖前文: key 用截至本句的整段文本; 有任何缺失就整段重跑 (一遍的代价).
+                # 命中统计按整段: 整段由缓存提供才算命中, 重跑时全部条目计为 miss
+                keys = [cache_key(ext.identity, "\n".join(sents[:i + 1]), ext.pooling, ext.layers)
+                        for i in range(len(sents))]
+                results = []
+                for k in keys:
+                    results.append(cache.get(k, count=False))
+                    if results[-1] is MISS: break
+                recompute = bool(results) and results[-1] is MISS
+                cache.record(not recompute, len(sents))
+                if recompute:
+                    results = ext.process_section(sents, window=window)
+                    for i in range(len(sents)):
+                        cache.put(keys[i], results[i], section=fname, sent=i)
+            else:
+                # 只计算缓存中缺失或过期的句子; 每批完成即写入并登记, 中断时只丢失进行中的一批
+                keys = [cache_key(ext.identity, s, ext.pooling, ext.layers) for s in sents]
+                results = [cache.get(k) for k in keys]
+                todo = [i for i, r in enumerate(results) if r is MISS]
+
+                def save_batch(done):
+                    for j, res in done:
+                        i = todo[j]
+                        results[i] = res
+                        cache.put(keys[i], res, section=fname, sent=i)
+                    cache.flush()
+                ext.process_batch([sents[i] for i in todo], on_batch=save_batch)
+        cache.flush()
+
+        embs, ids, skipped = [], [], []
+        for i, res in enumerate(results):
+            if res is None:
+                skipped.append((i, sents[i]))
+                continue
+            embs.append(res); ids.append(i)
+        # 每个 section 一个 [n_sent, n_layers, dim] 存储 + 索引
+        with stage("write_store", model=key, section=fname):
+            write_store(out, fname, embs, ids, [sents[i] for i in ids], skipped,
+                        layers=ext.layer_ids, n_layers=ext.n_layers, features=ext.feature_names)
+        cnt += len(ids)
+    print(f" {key} Done: {cnt} sentences. ({cache.report()})")
 
 if __name__ == "__main__":
     run("Base")
@@ -1,16 +1,19 @@
 import os
-import glob
+import json
 import numpy as np
 import pandas as pd
-import nibabel as nib
-import parselmouth
-from parselmouth.praat import call
-from sklearn.linear_model import RidgeCV, LinearRegression
+from nibabel.filebasedimages import ImageFileError
 from sklearn.decomposition import PCA
-from sklearn.preprocessing import StandardScaler
 from sklearn.model_selection import KFold
-from scipy.stats import pearsonr
 import warnings
+from emb_store import open_store, atomic_write
+from textgrid_io import sentence_intervals
+from encoding_utils import colwise_pearson, SVDRidge, remove_confound, PCA_SEED
+from parallel_cv import run_layer_cv
+from profiling import stage, enable as enable_profiling
+import results_store
+from fmri_prep import (find_run_file, load_run_matrix, sentence_bold, averaging_operator,
+                       block_size, voxel_blocks, bold_block)
 
 
 warnings.filterwarnings("ignore", category=RuntimeWarning)
@@ -20,6 +23,14 @@ BASE_DIR = "/root/autodl-tmp/project_data"
 FMRI_DIR = os.path.join(BASE_DIR, "fmri")
 TEXTGRID_DIR = os.path.join(BASE_DIR, "textgrid")
 RESULTS_DIR = os.path.join(BASE_DIR, "results_final_v2")
+FMRI_CACHE_DIR = os.path.join(BASE_DIR, "fmri_cache")
+# 脑 mask: None 使用整个 bounding box; "epi" 由平均 EPI 强度计算; 或 mask NIfTI 路径
+MASK = None
+# 峰值内存上限 (GB): None 时整个 run 一次处理 (原做法); 设定后预处理按时间块流式读取,
+# delay 搜索与体素选择按体素列块进行, 全分辨率被试也能在普通 CPU 节点上运行
+MEM_CAP_GB = None
+# 体素块内每列的中间量 ~ 若干份 [所有 delay 的句子数] (BOLD / 残差 / 预测 / 相关系数的 float64 副本)
+BLOCK_COPIES = 6
 os.makedirs(RESULTS_DIR, exist_ok=True)
 
 TR = 2.0
@@ -27,215 +38,326 @@ TR = 2.0
 PCA_N = 15 
 CANDIDATE_DELAYS = [4.0, 6.0, 8.0, 10.0] 
 RUN_IDS = [15, 16, 17, 18, 19, 20, 21, 22, 23]
+# 被试 -> fMRI 目录; 多被试调度见 scheduler.py
+DEFAULT_SUBJECT = "EN057"
+SUBJECTS = {DEFAULT_SUBJECT: FMRI_DIR}
+# 逐层 CV 的岭回归候选 alpha, 每个体素单独选择 (一次 SVD 评估全部候选, 加宽代价很小)
+RIDGE_ALPHAS = [100, 1000, 10000]
+# 层 x fold 并行: worker 数 (<=1 为串行) 与每个 worker 的 BLAS 线程上限
+N_WORKERS = min(8, os.cpu_count() or 1)
+BLAS_THREADS = 1
+# 每个单元另存留出预测 (run{N}_heldout.npz), significance.py 在其上做置换检验 / bootstrap
+SAVE_HELDOUT = True
+# 列式结果存储 (Parquet, 层 / fold / 体素级明细, 见 results_store.py); None 不写
+RESULTS_STORE = os.path.join(RESULTS_DIR, "store")
+# 阶段计时 / 内存剖析日志 (JSON lines, 见 profiling.py); None 不记录
+PROFILE_LOG = None
 
 # === 辅助函数 ===
 def get_sentence_intervals(tg_path):
+    # 每句 (onset, offset), 与 step1 的句子一一对应 (共用 textgrid_io 的切分规则)
+    return sentence_intervals(tg_path)
+
+def load_run(run_id, fmri_dir=FMRI_DIR):
+    # (M, voxels, vol_shape): 预处理后的 [n_tr, n_vox] 矩阵 (memmap) 与各列的体积下标
+    # 每个 run 只读取/标准化一次; 读不了的 run 跳过, mask 配置错误 (MaskError) 直接抛出
+    f = find_run_file(fmri_dir, run_id)
+    if f is None: return None
     try:
-        tg = parselmouth.read(tg_path)
-        n = call(tg, "Get number of intervals", 1)
-        sents, on, off, has = [], -1, -1, False
-        for i in range(1, int(n)+1):
-            lbl = call(tg, "Get label of interval", 1, i).strip()
-            t1, t2 = call(tg, "Get start point", 1, i), call(tg, "Get end point", 1, i)
-            if not lbl: continue
-            if lbl == "#":
-                if has: sents.append((on, off)); has=False
-            elif lbl not in ["<sil>", "sp", "SIL"]:
-                if not has: on=t1; has=True
-                off = t2
-        if has: sents.append((on, off))
-        return sents
-    except: return []
-
-def load_fmri_with_delay(run_id, intervals, delay):
-    fs = glob.glob(os.path.join(FMRI_DIR, f"*run?{run_id}*.nii.gz"))
-    if not fs: return None
-    try:
-        data = nib.load(fs[0]).get_fdata()
-    except: return None
-    
-    n_tr = data.shape[-1]
-    flat = data.reshape(-1, n_tr).T
-    # 全脑标准化
-    masked = StandardScaler().fit_transform(flat)
-    
-    sent_bold = []
-    for t1, t2 in intervals:
-        tr_start = int((t1 + delay) / TR)
-        tr_end = int((t2 + delay) / TR) + 1
-        if tr_start >= n_tr: break
-        tr_end = min(tr_end, n_tr)
-        if tr_end > tr_start:
-            sent_bold.append(np.mean(masked[tr_start:tr_end], axis=0))
-        else:
-            sent_bold.append(masked[tr_start])
-            
-    if len(sent_bold) == 0: return None
-    return np.array(sent_bold)
-
-def remove_confound(X, confounds):
-    if confounds.ndim == 1: confounds = confounds.reshape(-1, 1)
-    # 检查是否常数，避免报错
-    if np.std(confounds) < 1e-9: return X 
-    reg = LinearRegression().fit(confounds, X)
-    return X - reg.predict(confounds)
+        return load_run_matrix(f, FMRI_CACHE_DIR, MASK, MEM_CAP_GB)
+    except (OSError, ValueError, ImageFileError): return None
 
-# === 分析核心 (Cross-Validation) ===
-def analyze(name, feat_folder_name):
-    print(f"\n Analysis: {name} (5-Fold CV + PCA{PCA_N} + VoxelSelect)", flush=True)
-    feat_base = os.path.join(BASE_DIR, feat_folder_name)
+def load_fmri_with_delay(run_id, intervals, delay, M=None):
+    if M is None:
+        loaded = load_run(run_id)
+        if loaded is None: return None
+        M = loaded[0]
+    return sentence_bold(M, intervals, delay, TR)
+
+# === 结果检查点: 每个 (模型, 被试, run) 单元一个文件 ===
+def unit_path(name, subject, run, suffix=".json"):
+    return os.path.join(RESULTS_DIR, "units", name, subject, f"run{run}{suffix}")
+
+def save_unit(name, subject, run, res):
+    # 原子写入: 中断时不会留下半个检查点
+    path = unit_path(name, subject, run)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    data = json.dumps(res)
+    atomic_write(path, lambda fh: fh.write(data.encode("utf-8")))
+
+def save_heldout(path, layers, ids, preds, Y_test, fold):
+    # preds [n_layers, n_sent, n_vox]: 每句来自它所在 fold 的测试集预测; Y_test 为逐 fold 去偏后的目标
+    data = dict(layers=np.asarray(layers), ids=np.asarray(ids), preds=preds, Y=Y_test, fold=fold)
+    atomic_write(path, lambda fh: np.savez(fh, **data))
+
+def load_unit(name, subject, run):
+    path = unit_path(name, subject, run)
+    if not os.path.exists(path): return None
+    with open(path, encoding="utf-8") as fh:
+        return json.load(fh)
+
+def write_results_csv(name, subjects=None, runs=None):
+    # 由单元检查点汇总为 {name}_final_results.csv (行: 层, 列: Run / 被试_Run)
+    subjects = subjects or list(SUBJECTS)
     results = {}
+    for subject in subjects:
+        for run in runs or RUN_IDS:
+            res = load_unit(name, subject, run)
+            if res is None: continue
+            col = f"Run{run}" if len(subjects) == 1 else f"{subject}_Run{run}"
+            # 行索引为实际层号
+            results[col] = pd.Series(res["scores"], index=res["layers"])
+    if results:
+        pd.DataFrame(results).to_csv(os.path.join(RESULTS_DIR, f"{name}_final_results.csv"))
+    return results
+
+# === 分析核心 (Cross-Validation) ===
+# 一个 run 的 fMRI 端 (区间解析 / fMRI 加载 / delay 搜索 / 体素选择 / Y 去偏) 与模型无关时
+# 可以被多个特征集共用. TARGET_SELECTION:
+#   "per-model": delay 与体素由各模型自己的中间层特征选择 (原始做法), 只共享区间和 fMRI 加载
+#   "shared":    delay 与体素由参考特征集 selection_ref 选择一次, 所有模型在同一目标上评估.
+#                selection_ref 必须显式给出: 被比较模型的名称, 或不参与比较的特征目录 (相对 BASE_DIR 或绝对路径).
+#                用被比较的模型作参考时, 目标是按它自己的拟合挑出来的, 比较会偏向该模型; 无偏比较应使用独立的参考特征集
+TARGET_SELECTION = "per-model"
+
+def load_features(feat_base, fname):
+    # (X memmap, index, {句子 id: 行号})
+    X, index = open_store(feat_base, fname)
+    if X is None or len(X) == 0: return None
+    return X, index, {sid: row for row, sid in enumerate(index["sent_ids"])}
+
+def probe_layer(index):
+    # 存储可能只含部分层: 用最接近模型中间层的那一层做探针
+    return int(np.argmin([abs(l - index["n_layers"] // 2) for l in index["layers"]]))
+
+def prepare_run(run, fmri_dir=FMRI_DIR):
+    # 与模型无关的部分: 句子区间 + 预处理后的 fMRI
+    sec = run - 14
+    tg = os.path.join(TEXTGRID_DIR, f"lppEN_section{sec}.TextGrid")
+    if not os.path.exists(tg): return None
     
-    kf = KFold(n_splits=5, shuffle=True, random_state=42)
-    
-    for run in RUN_IDS:
-        print(f"   Processing Run {run}...", end="\r", flush=True)
-        sec = run - 14
-        tg = os.path.join(TEXTGRID_DIR, f"lppEN_section{sec}.TextGrid")
-        if not os.path.exists(tg): continue
-        
+    with stage("textgrid"):
         intervals = get_sentence_intervals(tg)
-        if not intervals: continue
-        
-        durations = np.array([t2-t1 for t1, t2 in intervals]).reshape(-1, 1)
-        
-        pat = os.path.join(feat_base, f"*section{sec}*.npy")
-        fs = sorted(glob.glob(pat), key=lambda x: int(x.split('sent')[-1].split('.')[0]))
-        if not fs: continue
-        X_raw_stack = np.stack([np.load(f) for f in fs]) 
-        
-        # === Step 1: 搜索最佳 Delay ===
-        best_delay = 6.0
-        best_score = -999
-        best_Y = None
-        
-        mid_layer = X_raw_stack.shape[1] // 2
-        X_probe = X_raw_stack[:, mid_layer, :]
-        
-        for d in CANDIDATE_DELAYS:
-            Y_probe = load_fmri_with_delay(run, intervals, d)
-            if Y_probe is None: continue 
-            
-            n_min = min(len(Y_probe), len(X_probe))
+    if not intervals: return None
+    
+    # 整个 run 只加载一次, 各 delay / 各模型共用
+    with stage("load_fmri"):
+        loaded = load_run(run, fmri_dir)
+    if loaded is None: return None
+    M, voxels, vol_shape = loaded
+    return {"run": run, "fname": os.path.basename(tg), "intervals": intervals,
+            "M": M, "voxels": voxels, "vol_shape": vol_shape}
+
+def select_target(prep, feats, ids, label):
+    # delay 搜索 + 体素选择 (用 feats 的中间层); ids 为参与分析的句子 id
+    X_all, index, row_of = feats
+    intervals = [prep["intervals"][i] for i in ids]
+    durations = np.array([t2-t1 for t1, t2 in intervals]).reshape(-1, 1)
+    
+    # === Step 1: 搜索最佳 Delay ===
+    best_delay = 6.0
+    best_score = -999
+    best = None
+    
+    mid_layer = probe_layer(index)
+    X_probe = np.asarray(X_all[:, mid_layer, :])[[row_of[i] for i in ids]]
+    
+    # 所有候选 delay 的句子级 BOLD 用一个堆叠的稀疏平均算子; 体素按列块处理,
+    # 内存中只有一个块的 [句子数, 块大小] 中间量 (MEM_CAP_GB 为 None 时只有一块, 即整脑一次算完)
+    M = prep["M"]
+    n_tr, n_vox = M.shape
+    A, offsets = averaging_operator(intervals, CANDIDATE_DELAYS, n_tr, TR)
+    block = block_size(n_vox, 4 * (n_tr + BLOCK_COPIES * A.shape[0]), MEM_CAP_GB)
+    
+    with stage("delay_probe", n_vox=int(n_vox), block=int(block)):
+        # X 端 (PCA) 每个 delay 只算一次
+        probes = {}
+        for k, d in enumerate(CANDIDATE_DELAYS):
+            n_min = min(offsets[k + 1] - offsets[k], len(X_probe))
             if n_min < 20: continue
-            
-            X_p = X_probe[:n_min]
-            Y_p = Y_probe[:n_min]
-            
+        
             # 快速验证
             split = int(n_min * 0.8)
-            pca = PCA(n_components=10) 
-            
+            pca = PCA(n_components=10, random_state=PCA_SEED)
             try:
-                X_tr = pca.fit_transform(X_p[:split])
-                X_te = pca.transform(X_p[split:])
-                ridge = RidgeCV(alphas=[1000]).fit(X_tr, Y_p[:split])
-                preds = ridge.predict(X_te)
-                
-                Y_te = Y_p[split:]
-                corrs = []
-                for v in range(preds.shape[1]):
-                    # 消除 ConstantInputWarning
-                    if np.std(preds[:,v]) > 1e-9 and np.std(Y_te[:,v]) > 1e-9:
-                        r = pearsonr(preds[:, v], Y_te[:, v])[0]
-                        if not np.isnan(r): corrs.append(r)
-                
-                if not corrs: continue
-                # 用最容易预测的 Top 100 体素来定 Delay
-                score = np.mean(np.sort(corrs)[-100:])
-                
-                if score > best_score:
-                    best_score = score
-                    best_delay = d
-                    best_Y = Y_p
+                X_tr = pca.fit_transform(X_probe[:split])
+                X_te = pca.transform(X_probe[split:n_min])
             except: continue
-        
-        print(f"   [Run {run}] Best Delay: {best_delay}s (Probe Score: {best_score:.4f})")
-        if best_Y is None: continue
-        
-        # === Step 2: 准备全数据 ===
-        Y = best_Y
-        n_final = len(Y)
-        X_raw = X_raw_stack[:n_final]
-        durations = durations[:n_final]
-        
-        # === Step 3: Voxel Selection (基于全数据L16) ===
-        # 使用全数据筛选体素 (ROI definition)，
-        # 比起在每个Fold里变动ROI，这样更稳定且便于解释
-        X_sel = X_raw[:, mid_layer, :]
-        pca_sel = PCA(n_components=min(10, n_final-1))
-        X_sel_clean = remove_confound(pca_sel.fit_transform(X_sel), durations)
-        Y_clean = remove_confound(Y, durations)
-        
-        ridge_sel = RidgeCV(alphas=[1000]).fit(X_sel_clean, Y_clean)
-        preds_sel = ridge_sel.predict(X_sel_clean)
-        
-        train_corrs = []
-        for v in range(Y.shape[1]):
-            if np.std(preds_sel[:,v]) > 1e-9 and np.std(Y_clean[:,v]) > 1e-9:
-                r = pearsonr(preds_sel[:, v], Y_clean[:, v])[0]
-                train_corrs.append(r if not np.isnan(r) else -1)
-            else:
-                train_corrs.append(-1)
-        
-        # 锁定 Top 300 语言相关体素
-        top_voxel_indices = np.argsort(train_corrs)[-300:]
-        Y_roi = Y[:, top_voxel_indices]
-        
-        # === Step 4: 5-Fold Cross Validation (逐层回归) ===
-        layer_scores_cv = []
-        
-        for l in range(X_raw.shape[1]):
-            X_layer = X_raw[:, l, :]
-            fold_scores = []
-            
-            for train_idx, test_idx in kf.split(X_layer):
-                X_train, X_test = X_layer[train_idx], X_layer[test_idx]
-                Y_train, Y_test = Y_roi[train_idx], Y_roi[test_idx]
-                C_train, C_test = durations[train_idx], durations[test_idx]
-                
-                # 关键：分别去偏
-                Y_train = remove_confound(Y_train, C_train)
-                Y_test = remove_confound(Y_test, C_test)
-                
-                # PCA
-                n_comp = min(PCA_N, len(train_idx)-1)
-                pca = PCA(n_components=n_comp)
-                X_train = remove_confound(pca.fit_transform(X_train), C_train)
-                X_test = remove_confound(pca.transform(X_test), C_test)
-                
-                # 强正则化防止过拟合
-                ridge = RidgeCV(alphas=[100, 1000, 10000])
-                ridge.fit(X_train, Y_train)
-                preds = ridge.predict(X_test)
-                
-                # 计算相关性
-                corrs = []
-                for v in range(Y_test.shape[1]):
-                    if np.std(preds[:, v]) > 1e-9 and np.std(Y_test[:, v]) > 1e-9:
-                        r = pearsonr(preds[:, v], Y_test[:, v])[0]
-                        if not np.isnan(r): corrs.append(r)
-                
-                # 记录该 Fold 的表现
-                if corrs:
-                    fold_scores.append(np.mean(corrs))
-                else:
-                    fold_scores.append(0)
-            
-            mean_score = np.mean(fold_scores)
-            layer_scores_cv.append(mean_score)
-            
-            print(f"     L{l:02d}: CV-r={mean_score:.4f}", flush=True)
-                
-        results[f"Run{run}"] = layer_scores_cv
-
-        df = pd.DataFrame(results)
-        df.to_csv(os.path.join(RESULTS_DIR, f"{name}_final_results.csv"))
-        print(f"   (Auto-saved progress after Run {run})")
+            probes[d] = (offsets[k], n_min, split, X_tr, X_te)
+    
+        # 用最容易预测的 Top 100 体素来定 Delay; 每块只保留当前 Top 100, 与整脑排序结果相同
+        top = {d: np.empty(0) for d in probes}
+        for cols in voxel_blocks(n_vox, block):
+            B = bold_block(A, M, cols)
+            for d, (o, n_min, split, X_tr, X_te) in probes.items():
+                Y_p = B[o:o + n_min]
+                preds = SVDRidge(alphas=[1000]).fit(X_tr, Y_p[:split]).predict(X_te)
+                r = colwise_pearson(preds, Y_p[split:])
+                top[d] = np.sort(np.concatenate([top[d], r[~np.isnan(r)]]))[-100:]
+            del B
+    
+    for d in probes:
+        if top[d].size == 0: continue
+        score = np.mean(top[d])
+        if score > best_score:
+            best_score = score
+            best_delay = d
+            best = probes[d]
+    
+    print(f"   [Run {prep['run']}] Best Delay: {best_delay}s (Probe Score: {best_score:.4f}, selected by {label})")
+    if best is None: return None
+    
+    # === Step 2: 准备全数据 ===
+    o, n_final = best[0], best[1]
+    A_best = A[o:o + n_final]
+    durations = durations[:n_final]
+    
+    # === Step 3: Voxel Selection (基于全数据中间层, 默认 L16) ===
+    # 使用全数据筛选体素 (ROI definition)，
+    # 比起在每个Fold里变动ROI，这样更稳定且便于解释
+    X_sel = X_probe[:n_final]
+    pca_sel = PCA(n_components=min(10, n_final-1), random_state=PCA_SEED)
+    X_sel_clean = remove_confound(pca_sel.fit_transform(X_sel), durations)
+    
+    # 去混淆 / 岭回归 / 相关都是逐列独立的, 按体素块计算
+    # 常数列 / NaN 记为 -1, 不会被选中
+    train_corrs = np.empty(n_vox)
+    with stage("voxel_selection", n_vox=int(n_vox), block=int(block)):
+        for cols in voxel_blocks(n_vox, block):
+            Y_clean = remove_confound(bold_block(A_best, M, cols), durations)
+            preds_sel = SVDRidge(alphas=[1000]).fit(X_sel_clean, Y_clean).predict(X_sel_clean)
+            train_corrs[cols] = np.nan_to_num(colwise_pearson(preds_sel, Y_clean), nan=-1)
+    
+    # 锁定 Top 300 语言相关体素
+    top_voxel_indices = np.argsort(train_corrs)[-300:]
+    # 映射回体积空间 (mask 后列号 != 体素下标)
+    top_flat = prep["voxels"][top_voxel_indices]
+    return {"selected_by": label, "delay": best_delay, "probe_score": float(best_score),
+            "ids": list(ids[:n_final]), "Y_roi": bold_block(A_best, M, top_voxel_indices), "durations": durations,
+            "top_flat": top_flat, "vol_shape": prep["vol_shape"]}
+
+def evaluate_features(name, feat_base, feats, prep, target, n_workers=N_WORKERS, heldout_path=None, detail=False):
+    # detail 时返回 (结果, 明细): 明细为每 (层, fold, 体素) 的留出 r 与选中的 alpha
+    # === Step 4: 5-Fold Cross Validation (逐层回归, 层 x fold 并行) ===
+    kf = KFold(n_splits=5, shuffle=True, random_state=42)
+    X_all, index, row_of = feats
+    layers = index["layers"]
+    rows = np.array([row_of[i] for i in target["ids"]])
+    splits = list(kf.split(rows))
+    Y_roi, durations = target["Y_roi"], target["durations"]
+    fold_scores = run_layer_cv((feat_base, prep["fname"]), rows, Y_roi, durations,
+                               len(layers), splits, PCA_N, RIDGE_ALPHAS, n_workers, BLAS_THREADS,
+                               keep_preds=heldout_path is not None or detail)
+    if heldout_path is not None or detail:
+        fold_scores, preds, alpha = fold_scores
+        Y_test, fold = np.zeros_like(Y_roi), np.zeros(len(rows), dtype=np.int16)
+        voxel_r = np.empty(alpha.shape)
+        for f, (_, test_idx) in enumerate(splits):
+            Y_test[test_idx] = remove_confound(Y_roi[test_idx], durations[test_idx])
+            fold[test_idx] = f
+            for l in range(len(layers)):
+                voxel_r[l, f] = colwise_pearson(preds[l, test_idx], Y_test[test_idx])
+        if heldout_path is not None:
+            with stage("save_heldout"):
+                save_heldout(heldout_path, layers, target["ids"], preds, Y_test, fold)
+    layer_scores_cv = fold_scores.mean(axis=1)
+    print(f"   {name}:")
+    for l, mean_score in enumerate(layer_scores_cv):
+        print(f"     L{layers[l]:02d}: CV-r={mean_score:.4f}", flush=True)
+    res = {"model": name, "run": prep["run"],
+           "layers": [int(l) for l in layers], "scores": layer_scores_cv.tolist(),
+           "fold_scores": fold_scores.tolist(), "delay": target["delay"], "probe_score": target["probe_score"],
+           "selection": target["selected_by"], "n_sentences": len(target["ids"])}
+    return (res, {"voxel_r": voxel_r, "alpha": alpha}) if detail else res
+
+def analyze_run_multi(models, run, fmri_dir=FMRI_DIR, subject=DEFAULT_SUBJECT,
+                      selection=TARGET_SELECTION, selection_ref=None, n_workers=N_WORKERS):
+    # models: {名称: 特征目录 (绝对路径)}; 已完成的模型跳过. 返回 {名称: 结果}
+    if selection == "shared" and not selection_ref:
+        raise ValueError("shared target selection needs an explicit selection_ref")
+    todo = {n: f for n, f in models.items() if load_unit(n, subject, run) is None}
+    if not todo: return {}
+    print(f"   Processing {subject} Run {run} ({', '.join(todo)}; selection={selection})...", flush=True)
+    with stage("run", subject=subject, run=run, selection=selection):
+        return _analyze_run(models, todo, run, fmri_dir, subject, selection, selection_ref, n_workers)
+
+def _analyze_run(models, todo, run, fmri_dir, subject, selection, selection_ref, n_workers):
+    with stage("prepare_run"):
+        prep = prepare_run(run, fmri_dir)
+    if prep is None: return {}
+    n_intervals = len(prep["intervals"])
+    
+    with stage("load_features"):
+        feats = {n: load_features(f, prep["fname"]) for n, f in models.items()}
+    feats = {n: x for n, x in feats.items() if x is not None}
+    if not feats: return {}
+    
+    if selection == "shared":
+        # 目标端只算一次: 参考特征集选 delay / 体素, 句子取各模型共有的部分
+        if selection_ref in models:
+            ref, ref_feats = selection_ref, feats.get(selection_ref)
+        else:
+            ref = os.path.basename(os.path.normpath(selection_ref))
+            ref_feats = load_features(os.path.join(BASE_DIR, selection_ref), prep["fname"])
+        if ref_feats is None: return {}
+        common = set.intersection(*(set(x[2]) for x in list(feats.values()) + [ref_feats]))
+        ids = sorted(i for i in common if i < n_intervals)
+        with stage("select_target", selected_by=f"shared:{ref}"):
+            shared_target = select_target(prep, ref_feats, ids, f"shared:{ref}")
+        if shared_target is None: return {}
+    elif selection != "per-model":
+        raise ValueError(f"unknown target selection {selection!r}")
+    
+    out = {}
+    for name in todo:
+        if name not in feats: continue
+        if selection == "shared":
+            target = shared_target
+        else:
+            # 按句子 id 对齐时间区间, 跳过的句子不参与
+            ids = [i for i in feats[name][1]["sent_ids"] if i < n_intervals]
+            with stage("select_target", model=name, selected_by=f"model:{name}"):
+                target = select_target(prep, feats[name], ids, f"model:{name}")
+            if target is None: continue
+        os.makedirs(os.path.dirname(unit_path(name, subject, run)), exist_ok=True)
+        np.savez(unit_path(name, subject, run, "_top_voxels.npz"), flat=target["top_flat"],
+                 ijk=np.column_stack(np.unravel_index(target["top_flat"], target["vol_shape"])),
+                 vol_shape=target["vol_shape"])
+        # 留出预测先于检查点写入: 有检查点的单元一定有对应的 _heldout.npz
+        heldout = unit_path(name, subject, run, "_heldout.npz") if SAVE_HELDOUT else None
+        with stage("evaluate", model=name, n_layers=len(feats[name][1]["layers"]), n_workers=n_workers):
+            out_res = evaluate_features(name, models[name], feats[name], prep, target, n_workers, heldout,
+                                        detail=RESULTS_STORE is not None)
+        res, detail = out_res if RESULTS_STORE is not None else (out_res, None)
+        res["subject"] = subject
+        # 只写本单元的分区; 同样先于检查点写入
+        if detail is not None:
+            with stage("write_store"):
+                results_store.write_unit(RESULTS_STORE, name, subject, run, res, detail["voxel_r"],
+                                         detail["alpha"], target["top_flat"])
+        save_unit(name, subject, run, res)
+        out[name] = res
+    return out
+
+def analyze_run(name, feat_base, run, fmri_dir=FMRI_DIR, subject=DEFAULT_SUBJECT, n_workers=N_WORKERS):
+    return analyze_run_multi({name: feat_base}, run, fmri_dir, subject, "per-model", n_workers=n_workers).get(name)
+
+def analyze_multi(models, subject=DEFAULT_SUBJECT, selection=TARGET_SELECTION, selection_ref=None):
+    # models: {名称: 特征目录名}; N 个模型只做一遍 fMRI 端的准备
+    print(f"\n Analysis: {', '.join(models)} (5-Fold CV + PCA{PCA_N} + VoxelSelect, selection={selection})", flush=True)
+    if PROFILE_LOG: enable_profiling(PROFILE_LOG)
+    feat_dirs = {n: os.path.join(BASE_DIR, f) for n, f in models.items()}
+    for run in RUN_IDS:
+        done = analyze_run_multi(feat_dirs, run, SUBJECTS[subject], subject, selection, selection_ref)
+        if done: print(f"   (Checkpointed Run {run}: {', '.join(done)})")
+    for name in models:
+        write_results_csv(name, [subject])
+
+def analyze(name, feat_folder_name, subject=DEFAULT_SUBJECT):
+    analyze_multi({name: feat_folder_name}, subject, "per-model")
 
 if __name__ == "__main__":
     if os.path.exists(os.path.join(BASE_DIR, "embeddings_base")):
-        analyze("Base", "embeddings_base")
-        analyze("Instruct", "embeddings_instruct")
+        analyze_multi({"Base": "embeddings_base", "Instruct": "embeddings_instruct"})
     else:
         print("please run step1_extract_mean.py to generate embeddings_base！")
@@ -0,0 +1,104 @@
+import os
+import re
+from collections import namedtuple
+
+# === TextGrid 解析 (step1 / step2 共用) ===
+# 直接读取 Praat 文本格式 (长格式/短格式, UTF-8 或带 BOM 的 UTF-16), 一遍得到单词、时间和句子边界.
+# 按文件 (路径, mtime, 大小) 缓存解析结果; 格式错误抛出 TextGridError, 不再静默返回 []
+SENT_BOUNDARY = "#"
+SILENCE_LABELS = ("<sil>", "sp", "SIL")
+
+Interval = namedtuple("Interval", ["xmin", "xmax", "text"])
+Tier = namedtuple("Tier", ["tier_class", "name", "xmin", "xmax", "items"])
+Sentence = namedtuple("Sentence", ["words", "times", "onset", "offset"])
+
+# 字符串 ("" 为转义引号) | [下标] (忽略) | 标志 | 数字; 其余 (xmin = 之类的键名) 都是注释
+TOKEN_RE = re.compile(r'"((?:[^"]|"")*)"|\[[^\]\n]*\]|<(exists|absent)>|([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)')
+
+_cache = {}
+
+class TextGridError(ValueError):
+    pass
+
+def _decode(raw, path):
+    if raw.startswith((b"\xfe\xff", b"\xff\xfe")):
+        return raw.decode("utf-16")
+    try:
+        return raw.decode("utf-8-sig")
+    except UnicodeDecodeError as e:
+        raise TextGridError(f"{path}: not UTF-8 or UTF-16 text ({e})") from None
+
+def _tokens(text):
+    for m in TOKEN_RE.finditer(text):
+        if m.group(1) is not None: yield m.group(1).replace('""', '"')
+        elif m.group(2) is not None: yield "<" + m.group(2) + ">"
+        elif m.group(3) is not None: yield float(m.group(3))
+
+def parse_tiers(path):
+    with open(path, "rb") as fh:
+        toks = list(_tokens(_decode(fh.read(), path)))
+    pos = 0
+
+    def take(kind, what):
+        nonlocal pos
+        if pos >= len(toks):
+            raise TextGridError(f"{path}: unexpected end of file while reading {what}")
+        tok = toks[pos]
+        if not isinstance(tok, kind):
+            raise TextGridError(f"{path}: expected {what}, got {tok!r} (token {pos})")
+        pos += 1
+        return tok
+
+    if take(str, "file type") != "ooTextFile" or take(str, "object class") != "TextGrid":
+        raise TextGridError(f"{path}: not a Praat TextGrid text file")
+    take(float, "xmin"); take(float, "xmax")
+    if take(str, "tiers flag") != "<exists>": return []
+    tiers = []
+    for _ in range(int(take(float, "tier count"))):
+        tier_class, name = take(str, "tier class"), take(str, "tier name")
+        xmin, xmax, n = take(float, "tier xmin"), take(float, "tier xmax"), int(take(float, "item count"))
+        if tier_class == "IntervalTier":
+            items = [Interval(take(float, "interval xmin"), take(float, "interval xmax"), take(str, "interval text"))
+                     for _ in range(n)]
+        elif tier_class == "TextTier":
+            items = [(take(float, "point time"), take(str, "point mark")) for _ in range(n)]
+        else:
+            raise TextGridError(f"{path}: unknown tier class {tier_class!r}")
+        tiers.append(Tier(tier_class, name, xmin, xmax, items))
+    return tiers
+
+def segment(intervals):
+    # 句子切分规则: 空标签跳过; "#" 为句子边界; 静音标签忽略; 其余为单词
+    sents, words, times = [], [], []
+    for t1, t2, lbl in intervals:
+        lbl = lbl.strip()
+        if not lbl: continue
+        if lbl == SENT_BOUNDARY:
+            if words: sents.append(Sentence(tuple(words), tuple(times), times[0][0], times[-1][1]))
+            words, times = [], []
+        elif lbl not in SILENCE_LABELS:
+            words.append(lbl); times.append((t1, t2))
+    if words: sents.append(Sentence(tuple(words), tuple(times), times[0][0], times[-1][1]))
+    return sents
+
+def load_sentences(path, tier=0):
+    # 同一文件未修改时直接返回缓存结果
+    st = os.stat(path)
+    key = (os.path.realpath(path), tier)
+    hit = _cache.get(key)
+    if hit is not None and hit[0] == (st.st_mtime_ns, st.st_size):
+        return hit[1]
+    tiers = parse_tiers(path)
+    if tier >= len(tiers):
+        raise TextGridError(f"{path}: has {len(tiers)} tiers, tier {tier + 1} requested")
+    if tiers[tier].tier_class != "IntervalTier":
+        raise TextGridError(f"{path}: tier {tier + 1} is a {tiers[tier].tier_class}, not an IntervalTier")
+    sents = segment(tiers[tier].items)
+    _cache[key] = ((st.st_mtime_ns, st.st_size), sents)
+    return sents
+
+def sentence_texts(path):
+    return [" ".join(s.words) for s in load_sentences(path)]
+
+def sentence_intervals(path):
+    return [(s.onset, s.offset) for s in load_sentences(path)]
@@ -0,0 +1,103 @@
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import numpy as np
+import torch
+from tokenizers import Tokenizer, models, pre_tokenizers, decoders, trainers, processors
+from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+from step1_extract import Extractor
+from textgrid_io import sentence_texts
+
+# === 小型随机初始化 Llama: 无 GPU 环境下测吞吐 / 回归测试 ===
+# 分词器在仓库自带的 LPP TextGrid 上训练 byte-level BPE (与 Llama-3 一样用 Ġ 表示词首),
+# 权重随机初始化, 全部在本地生成, 不需要下载
+REPO_TEXTGRID_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "textgrid")
+BOS, EOS = "<|begin_of_text|>", "<|end_of_text|>"
+
+def load_sentences(textgrid_dir=REPO_TEXTGRID_DIR):
+    sents = []
+    for f in sorted(glob.glob(os.path.join(textgrid_dir, "*.TextGrid"))):
+        sents.extend(sentence_texts(f))
+    return sents
+
+def build_tiny_model(out_dir, n_layers=4, hidden=64, heads=4, vocab_size=2000, seed=0, sents=None):
+    sents = sents if sents is not None else load_sentences()
+    tok = Tokenizer(models.BPE())
+    tok.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tok.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(vocab_size=vocab_size, special_tokens=[BOS, EOS],
+                                  initial_alphabet=pre_tokenizers.ByteLevel.alphabet())
+    tok.train_from_iterator(sents, trainer)
+    tok.post_processor = processors.TemplateProcessing(
+        single=f"{BOS} $A", special_tokens=[(BOS, tok.token_to_id(BOS))])
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=tok, bos_token=BOS, eos_token=EOS)
+
+    config = LlamaConfig(
+        vocab_size=len(tokenizer),
+        hidden_size=hidden,
+        intermediate_size=hidden * 2,
+        num_hidden_layers=n_layers,
+        num_attention_heads=heads,
+        num_key_value_heads=max(1, heads // 2),
+        max_position_embeddings=8192,
+        bos_token_id=tokenizer.bos_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+    )
+    torch.manual_seed(seed)
+    LlamaForCausalLM(config).save_pretrained(out_dir)
+    tokenizer.save_pretrained(out_dir)
+    return out_dir
+
+def max_diff(a, b):
+    pairs = [(x, y) for x, y in zip(a, b) if x is not None or y is not None]
+    if any(x is None or y is None for x, y in pairs): return float("inf")
+    return max((float(np.abs(x - y).max()) for x, y in pairs), default=0.0)
+
+def check(path, sents, threads=None, quantize=False, batch_size=16, tol=1e-4):
+    # 逐句 vs 批处理 的一致性与吞吐; 层子集 (提前退出) 与完整前向的一致性
+    ext = Extractor(path, device="cpu", threads=threads, quantize=quantize)
+    t0 = time.perf_counter()
+    single = [ext.process(s) for s in sents]
+    t1 = time.perf_counter()
+    batched = ext.process_batch(sents, batch_size=batch_size)
+    t2 = time.perf_counter()
+
+    sub = [0, ext.n_layers // 2]
+    ext_sub = Extractor(path, layers=sub, device="cpu", threads=threads, quantize=quantize)
+    subset = ext_sub.process_batch(sents, batch_size=batch_size)
+    full_sub = [None if x is None else x[sub] for x in batched]
+
+    report = {
+        "n_sentences": len(sents),
+        "n_kept": sum(x is not None for x in single),
+        "threads": torch.get_num_threads(),
+        "quantize": quantize,
+        "single_sent_per_s": len(sents) / (t1 - t0),
+        "batched_sent_per_s": len(sents) / (t2 - t1),
+        "batched_max_abs_diff": max_diff(single, batched),
+        "subset_max_abs_diff": max_diff(full_sub, subset),
+    }
+    report["ok"] = report["batched_max_abs_diff"] <= tol and report["subset_max_abs_diff"] <= tol
+    return report
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Tiny random Llama harness for CPU extraction")
+    ap.add_argument("--out", default="/tmp/tiny_llama")
+    ap.add_argument("--n-layers", type=int, default=4)
+    ap.add_argument("--hidden", type=int, default=64)
+    ap.add_argument("--n-sentences", type=int, default=200)
+    ap.add_argument("--threads", type=int, default=None)
+    ap.add_argument("--quantize", action="store_true")
+    ap.add_argument("--rebuild", action="store_true")
+    args = ap.parse_args()
+
+    sents = load_sentences()
+    if args.rebuild or not os.path.exists(os.path.join(args.out, "config.json")):
+        build_tiny_model(args.out, n_layers=args.n_layers, hidden=args.hidden, sents=sents)
+    # 量化模型逐句前向, 批处理与逐句一致, 容差与浮点模式相同
+    report = check(args.out, sents[:args.n_sentences], args.threads, args.quantize)
+    print(json.dumps(report, indent=1))
+    sys.exit(0 if report["ok"] else 1)